@@ -1,29 +1,80 @@
 from datetime import datetime, timedelta
+import contextlib
+import csv
 import random
 import isbnlib
+import itertools
 import json
 import os
 import re
+import sys
+import time
 import uuid
 
+from change_stream import ChangeStream
+from due_scheduler import DueDateScheduler
+from isbn_pipeline import canonical_isbn
+from library_indexes import FacetIndex, RangeIndexes, ReaderIndex, SortedIndex, TitleTrie
+from library_query import Query
+
 class LibraryManagement:
-    def __init__(self):
-        self.book_file = "Books_Library.json"
-        self.reader_file = "Lib_reader.json"
-        self.issued_books_file = "issued_books.json"
-        self.payment_file = "payments.json"
-        self.membership_file = "memberships.json"
+    def __init__(self, data_dir=".", reader_file=None):
+        self.data_dir = data_dir
+        self.book_file = os.path.join(data_dir, "Books_Library.json")
+        # Branches share one reader registry so readers are recognised everywhere
+        self.reader_file = reader_file or os.path.join(data_dir, "Lib_reader.json")
+        self.issued_books_file = os.path.join(data_dir, "issued_books.json")
+        self.payment_file = os.path.join(data_dir, "payments.json")
+        self.membership_file = os.path.join(data_dir, "memberships.json")
+        self.ledger_versions_file = os.path.join(data_dir, "ledger_versions.json")
+        self.payment_attempts_file = os.path.join(data_dir, "payment_attempts.json")
 
         """Load existing data"""
         self.books = self.load_library_data(self.book_file, [])
+        self.readers_modified = self.reader_file_mtime()
         self.readers = self.load_library_data(self.reader_file, [])
         self.issued_books = self.load_library_data(self.issued_books_file, [])
         self.payments = self.load_library_data(self.payment_file, [])
         self.memberships = self.load_library_data(self.membership_file, [])
+        self.payment_attempts = self.load_library_data(self.payment_attempts_file, {})
+
+        """Per-chunk write counters of the ledgers, so consistency checks only re-read changed chunks"""
+        self.ledger_chunk_size = 1000
+        self.ledger_versions = self.load_library_data(self.ledger_versions_file, {})
+        if "epoch" not in self.ledger_versions:
+            # A fresh epoch invalidates checker caches built before the counters existed
+            self.ledger_versions["epoch"] = uuid.uuid4().hex
+            self.save_books_to_json(self.ledger_versions_file, self.ledger_versions)
 
         """Create books index for faster searching"""
         self.books_index = {book["title"].lower(): book for book in self.books}
-        self.reader_index = {reader['phone'].lower(): reader for reader in self.readers}
+        self.books_by_id = {book["id"]: book for book in self.books}
+        self.index_payments()
+        self.reader_lookup = ReaderIndex(self.readers)
+        self.reader_index = self.reader_lookup.by_phone
+        self.title_index = TitleTrie(self.books)
+        self.facet_index = FacetIndex(self.books)
+        self.range_indexes = RangeIndexes(self.books)
+        self.books_by_isbn = {}
+        self.isbn_keys = {}
+        for book in self.books:
+            self.index_isbn(book)
+        self.page_size = 10
+        self.low_stock_level = 5
+        self.restock_level = 20
+
+        """Reminder and overdue events for open loans"""
+        self.due_scheduler = DueDateScheduler(self.issued_books,
+                                              outbox_file=os.path.join(data_dir, "reminder_outbox.jsonl"),
+                                              state_file=os.path.join(data_dir, "reminder_state.json"))
+
+        """Change-data-capture stream of every mutation"""
+        self.change_stream = ChangeStream(os.path.join(data_dir, "changes"))
+
+        """Repair join keys once, then index loans by issue_id"""
+        self.migrate_join_keys()
+        self.build_loan_indexes()
+        self.migrate_total_copies()
 
         """Payment methods and membership plans"""
         self.payment_methods = ["Cash", "Card", "UPI", "Net Banking", "Digital Wallet"]
@@ -56,6 +107,192 @@ class LibraryManagement:
             print(f"Error saving {filename}: {e}")
             return False
 
+    """Modification time of the reader file, or None if it does not exist yet"""
+    def reader_file_mtime(self):
+        try:
+            return os.stat(self.reader_file).st_mtime_ns
+        except OSError:
+            return None
+
+    """Hold the lock file that serializes writers of the (possibly shared) reader file"""
+    @contextlib.contextmanager
+    def reader_file_lock(self, stale_seconds=30):
+        lock_file = self.reader_file + ".lock"
+        while True:
+            try:
+                fd = os.open(lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                break
+            except FileExistsError:
+                # A desk that crashed while saving leaves its lock behind
+                try:
+                    if time.time() - os.path.getmtime(lock_file) > stale_seconds:
+                        os.remove(lock_file)
+                except OSError:
+                    pass
+                time.sleep(0.05)
+        try:
+            yield
+        finally:
+            os.close(fd)
+            os.remove(lock_file)
+
+    """Pick up readers saved by other branches, updating the loaded records in place"""
+    def refresh_readers(self):
+        modified = self.reader_file_mtime()
+        if modified is None or modified == self.readers_modified:
+            return
+        for saved in self.load_library_data(self.reader_file, []):
+            reader = self.reader_index.get(saved["phone"])
+            if reader is None:
+                self.readers.append(saved)
+                self.reader_lookup.add(saved)
+            elif reader != saved:
+                self.reader_lookup.remove(reader["phone"])
+                reader.clear()
+                reader.update(saved)
+                self.reader_lookup.add(reader)
+        self.readers_modified = modified
+
+    """Apply change() to the current saved readers and write them back; returns what change() returns"""
+    def save_readers(self, change=None):
+        # Branches share the reader file, so never write back a copy loaded before their last save
+        with self.reader_file_lock():
+            self.refresh_readers()
+            result = change() if change else None
+            temp_file = self.reader_file + ".tmp"
+            if self.save_books_to_json(temp_file, self.readers):
+                os.replace(temp_file, self.reader_file)
+                self.readers_modified = self.reader_file_mtime()
+        return result
+
+    """One-shot repair making issue_id/book_id usable as join keys (no-op once applied)"""
+    def migrate_join_keys(self):
+        changed_issues = []
+
+        # Issue IDs must be unique; older IDs were derived from phone and date and could repeat
+        seen = set()
+        changed_positions = []
+        for position, issued in enumerate(self.issued_books):
+            changed = False
+            if not issued.get("issue_id") or issued["issue_id"] in seen:
+                issued["issue_id"] = self.generate_issue_id()
+                changed = True
+            seen.add(issued["issue_id"])
+
+            # Book IDs are authoritative; fall back to the title only when the ID is missing or stale
+            if issued.get("book_id") not in self.books_by_id:
+                book = self.books_index.get(str(issued.get("book_title", "")).lower())
+                if book:
+                    issued["book_id"] = book["id"]
+                    changed = True
+            if changed:
+                changed_issues.append(issued)
+                changed_positions.append(position)
+
+        # Link each reader history entry to its issue record
+        issues_by_loan = {(issued["reader_phone"], issued["book_title"], issued["issue_date"]): issued
+                          for issued in self.issued_books}
+
+        def link_history():
+            changed_readers = []
+            for reader in self.readers:
+                changed = False
+                for entry in reader.get("books_issued", []):
+                    if entry.get("issue_id") in seen:
+                        continue
+                    issued = issues_by_loan.get((reader["phone"], entry["book_title"], entry["issue_date"]))
+                    if issued:
+                        entry["issue_id"] = issued["issue_id"]
+                        entry["book_id"] = issued["book_id"]
+                        changed = True
+                if changed:
+                    changed_readers.append(reader)
+            return changed_readers
+
+        changed_readers = link_history()
+
+        if changed_issues:
+            self.mark_ledger_chunks("issued_books", changed_positions)
+            self.save_books_to_json(self.issued_books_file, self.issued_books)
+            for issued in changed_issues:
+                self.record_change("update", "issue", issued["issue_id"], issued)
+        if changed_readers:
+            # Link again on the saved copy, which another branch may have changed since loading
+            changed_readers = self.save_readers(link_history)
+            for reader in changed_readers:
+                self.record_change("update", "reader", reader["reader_id"], reader)
+        if changed_issues or changed_readers:
+            print(f"Migrated join keys: {len(changed_issues)} issue record(s), {len(changed_readers)} reader(s)")
+
+    """Index loans by issue_id and open loans by due date, reader and book"""
+    def build_loan_indexes(self):
+        self.issues_by_id = {issued["issue_id"]: issued for issued in self.issued_books}
+        self.issue_positions = {issued["issue_id"]: i for i, issued in enumerate(self.issued_books)}
+        self.due_index = SortedIndex()
+        self.open_issues_by_reader = {}
+        self.open_issues_by_book = {}
+        for issued in self.issued_books:
+            if issued["status"] == "issued":
+                self.track_open_issue(issued)
+
+    """One-shot backfill of total_copies (copies owned = on the shelf + on loan) for older book records"""
+    def migrate_total_copies(self):
+        changed_books = []
+        for book in self.books:
+            if "total_copies" not in book:
+                book["total_copies"] = book["stock"] + len(self.open_issues_by_book.get(book["id"], {}))
+                changed_books.append(book)
+
+        if changed_books:
+            self.save_books_to_json(self.book_file, self.books)
+            for book in changed_books:
+                self.record_change("update", "book", book["id"], book)
+            print(f"Migrated total copies: {len(changed_books)} book(s)")
+
+    """Add a new book record to the catalog and every book index"""
+    def catalog_book(self, book):
+        self.books.append(book)
+        self.books_index[book["title"].lower()] = book
+        self.books_by_id[book["id"]] = book
+        self.reindex_book(book)
+
+    """Add copies to (or with a negative quantity take copies out of) the collection"""
+    def adjust_stock(self, book, quantity):
+        book["stock"] += quantity
+        book["total_copies"] = book.get("total_copies", 0) + quantity
+        self.reindex_book(book)
+
+    """Bump the version of the ledger chunks holding the given record positions; call before saving the ledger"""
+    def mark_ledger_chunks(self, ledger, positions):
+        chunks = {position // self.ledger_chunk_size for position in positions}
+        if not chunks:
+            return
+        versions = self.ledger_versions.setdefault(ledger, [])
+        for chunk in chunks:
+            versions.extend([0] * (chunk + 1 - len(versions)))
+            versions[chunk] += 1
+        self.save_books_to_json(self.ledger_versions_file, self.ledger_versions)
+
+    """Add an open loan to the loan indexes"""
+    def track_open_issue(self, issued):
+        self.due_index.add(issued["return_date"], issued["issue_id"])
+        self.open_issues_by_reader.setdefault(issued["reader_phone"], {})[issued["issue_id"]] = issued
+        self.open_issues_by_book.setdefault(issued["book_id"], {})[issued["issue_id"]] = issued
+
+    """Remove a returned loan from the open-loan indexes"""
+    def untrack_open_issue(self, issued):
+        self.due_index.remove(issued["return_date"], issued["issue_id"])
+        self.open_issues_by_reader.get(issued["reader_phone"], {}).pop(issued["issue_id"], None)
+        self.open_issues_by_book.get(issued["book_id"], {}).pop(issued["issue_id"], None)
+
+    """Start an ad-hoc query, e.g. self.query("books").where("price", "<=", 500).limit(10).run()"""
+    def query(self, collection):
+        return Query(self, collection)
+
+    """Emit a change event with a snapshot of the mutated record"""
+    def record_change(self, op, entity, key, record):
+        return self.change_stream.append(op, entity, key, dict(record))
+
     """Validate user card number"""
     @staticmethod
     def is_valid_card_number(card_num):
@@ -124,19 +361,64 @@ class LibraryManagement:
     def generate_payment_id():
         return f"PAY{datetime.now().strftime('%Y%d%m%H%M')}{random.randint(100, 999)}"
 
+    """Build hash indexes on payment_id, transaction_ref and idempotency key, and a per-reader date index"""
+    def index_payments(self):
+        self.payments_by_id = {}
+        self.payments_by_ref = {}
+        self.payments_by_key = {}
+        self.payments_by_reader = {}
+        for position, payment in enumerate(self.payments):
+            self.index_payment(payment, position)
+
+    """Add the payment at position to the payment indexes (the first record wins for legacy duplicates)"""
+    def index_payment(self, payment, position):
+        self.payments_by_id.setdefault(payment["payment_id"], payment)
+        # Settlement imports can append older payment dates, so history order comes from this index
+        self.payments_by_reader.setdefault(payment["reader_phone"], SortedIndex()).add(
+            str(payment.get("payment_date", "")), position)
+        if payment.get("transaction_ref"):
+            self.payments_by_ref.setdefault(payment["transaction_ref"], payment)
+        if payment.get("idempotency_key"):
+            self.payments_by_key.setdefault(payment["idempotency_key"], payment)
+
+    """Idempotency key for one purchase attempt; an unfinished attempt for the same purchase is a retry and reuses it"""
+    def begin_payment_attempt(self, reader_phone, purpose):
+        attempt = f"{reader_phone}:{purpose}"
+        if attempt not in self.payment_attempts:
+            self.payment_attempts[attempt] = f"{purpose.split(':')[0].upper()}-{uuid.uuid4()}"
+            self.save_books_to_json(self.payment_attempts_file, self.payment_attempts)
+        return self.payment_attempts[attempt]
+
+    """Close an attempt once its side effects are saved, so the next purchase gets a fresh key"""
+    def finish_payment_attempt(self, reader_phone, purpose):
+        if self.payment_attempts.pop(f"{reader_phone}:{purpose}", None):
+            self.save_books_to_json(self.payment_attempts_file, self.payment_attempts)
+
+    """Generate a payment ID not used by any recorded payment"""
+    def generate_unique_payment_id(self):
+        payment_id = self.generate_payment_id()
+        while payment_id in self.payments_by_id:
+            payment_id = self.generate_payment_id()
+        return payment_id
+
+    """Generate a transaction reference not used by any recorded payment"""
+    def generate_transaction_ref(self):
+        transaction_ref = f"TXN{random.randint(100000, 999999)}"
+        while transaction_ref in self.payments_by_ref:
+            transaction_ref = f"TXN{random.randint(100000, 999999)}"
+        return transaction_ref
+
     """Check Duplicate Books"""
     def check_book_duplicate(self, title):
         return any(b['title'].lower() == title.lower() for b in self.books)
 
-    """Generate a random ISBN-13"""
-    @staticmethod
-    def generate_isbn_id():
-        base = "978" + "".join([str(random.randint(0, 9)) for _ in range(9)])
-        try:
-            return isbnlib.to_isbn13(base)
-        except Exception as e:
-            print("Error to Generate ISBN: ",e)
-            return base + "0"
+    """Generate a random ISBN-13 with a valid check digit that no other book uses"""
+    def generate_isbn_id(self):
+        while True:
+            base = "978" + "".join([str(random.randint(0, 9)) for _ in range(9)])
+            isbn = base + isbnlib.check_digit13(base)
+            if isbn not in self.books_by_isbn:
+                return isbn
 
     """Validate Fine Date Format"""
     @staticmethod
@@ -158,6 +440,111 @@ class LibraryManagement:
         reader.setdefault("total_fine_paid", 0)
         reader.setdefault("pending_fine", 0)
 
+    """Index a book under its canonical ISBN-13, dropping the key it had before"""
+    def index_isbn(self, book):
+        self.unindex_isbn(book)
+        isbn = canonical_isbn(book.get("isbn"))
+        if isbn:
+            self.books_by_isbn.setdefault(isbn, book)
+            self.isbn_keys[book["id"]] = isbn
+
+    """Remove a book from the ISBN index"""
+    def unindex_isbn(self, book):
+        isbn = self.isbn_keys.pop(book["id"], None)
+        if isbn and self.books_by_isbn.get(isbn) is book:
+            del self.books_by_isbn[isbn]
+
+    """Refresh every book index after a book was added or changed"""
+    def reindex_book(self, book):
+        self.title_index.update(book)
+        self.facet_index.update(book)
+        self.range_indexes.update(book)
+        self.index_isbn(book)
+
+    """Drop a deleted book from every book index"""
+    def unindex_book(self, book):
+        self.title_index.remove(book["id"])
+        self.facet_index.remove(book["id"])
+        self.range_indexes.remove(book["id"])
+        self.unindex_isbn(book)
+
+    """Resolve a typed title to a book using the autocomplete index"""
+    def find_book(self, prompt):
+        book_name = input(prompt).strip()
+        if not book_name:
+            return book_name, None
+
+        # Exact title match first
+        book = self.books_index.get(book_name.lower())
+        if book:
+            return book_name, book
+
+        matches = self.title_index.complete(book_name)
+        if len(matches) <= 1:
+            return book_name, matches[0] if matches else None
+
+        print("\nMatching books:")
+        for i, match in enumerate(matches, 1):
+            print(f"{i}. {match["title"]} by {match["author"]} (Rating: {match["rating"]}, Stock: {match["stock"]})")
+        choice = self.get_choice(f"Select book (1-{len(matches)}): ", 1, len(matches))
+        return book_name, matches[choice - 1]
+
+    """Print a result stream one page at a time, only materializing the current page"""
+    def show_paginated(self, results, show_item, page_size=None):
+        page_size = page_size or self.page_size
+        results = iter(results)
+        page = list(itertools.islice(results, page_size))
+        shown = 0
+
+        while page:
+            for item in page:
+                show_item(item)
+            shown += len(page)
+
+            # Peek one item ahead to know whether another page exists
+            next_item = next(results, None)
+            if next_item is None:
+                break
+            if not self.get_yes_or_no(f"Showing 1-{shown}. Show next {page_size}? (y/n): "):
+                break
+            page = [next_item] + list(itertools.islice(results, page_size - 1))
+
+        return shown
+
+    """Return one page of open loans and the keyset cursor for the next page"""
+    def list_issued_books(self, cursor=None, limit=10, most_overdue_first=True):
+        entries = self.due_index.page(cursor, limit, reverse=not most_overdue_first)
+        next_cursor = entries[-1] if len(entries) == limit else None
+        return [self.issues_by_id[issue_id] for _, issue_id in entries], next_cursor
+
+    """Stream open loans in due-date order, fetching one page from the index at a time"""
+    def iter_issued_books(self, most_overdue_first=True):
+        cursor = None
+        while True:
+            page, cursor = self.list_issued_books(cursor, self.page_size, most_overdue_first)
+            yield from page
+            if cursor is None:
+                break
+
+    """Resolve a typed phone, reader ID, email or name to a reader"""
+    def find_reader(self, prompt="Enter phone number, reader ID, email or name: "):
+        key = input(prompt).strip()
+        self.refresh_readers()
+        reader = self.reader_lookup.find_exact(key) if key else None
+        if reader or not key or key.isdigit():
+            return key, reader
+
+        # A name prefix is not unique, so even a single match must be confirmed
+        matches = self.reader_lookup.search_name(key)
+        if not matches:
+            return key, None
+        print("\nMatching readers:")
+        for i, match in enumerate(matches, 1):
+            print(f"{i}. {match["name"]} ({match["phone"]}) - {match["reader_id"]}")
+        print("0. None of these")
+        choice = self.get_choice(f"Select reader (0-{len(matches)}): ", 0, len(matches))
+        return key, matches[choice - 1] if choice else None
+
     """Display Menu for Library Assistant"""
     @staticmethod
     def display_menu():
@@ -175,16 +562,23 @@ class LibraryManagement:
         print("9.  Purchase Book")
         print("10. Purchase Membership")
         print("11. View Payment History")
-        print("12. Exit")
+        print("12. Stock Report")
+        print("13. Exit")
         print("=" * 50)
 
     """Handle reader registration/login"""
     def handle_customer_registration(self):
         print("\n--- Reader Information ---")
-        phone = self.get_phone()
+        key, reader = self.find_reader()
+
+        # Registration is keyed on phone, so ask for it when another key did not match
+        if not reader and not (key.isdigit() and len(key) == 10):
+            print("Reader not found.")
+            key = self.get_phone()
+            reader = self.reader_index.get(key)
+        phone = key
 
-        if phone in self.reader_index:
-            reader = self.reader_index[phone]
+        if reader:
             self.fix_missing_fields(reader)
             print(f"\nWelcome back, {reader["name"]}!")
             print(f"Address: {reader["address"]}")
@@ -198,7 +592,7 @@ class LibraryManagement:
             address = input("Enter address (optional): ").strip()
 
             reader = {
-                "reader_id" : self.generate_reader_id(phone),
+                "reader_id" : None,
                 "name" : name,
                 "phone" : phone,
                 "email" : email,
@@ -210,12 +604,28 @@ class LibraryManagement:
                 "pending_fine": 0
             }
 
-            """Add to reader list and index"""
-            self.readers.append(reader)
-            self.reader_index[phone] = reader
-
-            """Save to file"""
-            self.save_books_to_json(self.reader_file, self.readers)
+            """Add to reader list and index, then save"""
+            def register():
+                # Another branch may have registered the same phone meanwhile
+                if phone in self.reader_index:
+                    return self.reader_index[phone]
+
+                # Reader IDs are a unique key, so disambiguate same-day registrations
+                reader_id = self.generate_reader_id(phone)
+                suffix = 1
+                while reader_id.upper() in self.reader_lookup.by_id:
+                    suffix += 1
+                    reader_id = f"{self.generate_reader_id(phone)}{suffix}"
+                reader["reader_id"] = reader_id
+                self.readers.append(reader)
+                self.reader_lookup.add(reader)
+                return reader
+
+            if self.save_readers(register) is not reader:
+                reader = self.reader_index[phone]
+                print(f"\nReader {reader["name"]} was just registered at another desk. Reader ID: {reader['reader_id']}")
+                return reader
+            self.record_change("insert", "reader", reader["reader_id"], reader)
             print(f"\nReader {reader["name"]} registered successfully! Reader ID: {reader['reader_id']}")
             return reader
 
@@ -231,8 +641,9 @@ class LibraryManagement:
         membership = self.check_membership_status(reader)
         book_limit = membership["book_limit"] if membership else 2 # Default limit for non-members
 
-        current_issued = len([book for book in self.issued_books
-                              if book["reader_phone"] == reader["phone"] and book["status"] == "issued"])
+        # The shared reader record also counts loans open at other branches
+        current_issued = max(len(self.open_issues_by_reader.get(reader["phone"], {})),
+                             reader.get("total_books_issued", 0))
 
         if current_issued >= book_limit:
             limit_type = f"{membership["plan"]} membership" if membership else "non-member"
@@ -250,14 +661,7 @@ class LibraryManagement:
                 return
 
         # Search for book
-        book_name = input("\nEnter the book name to issue: ").strip()
-        book = None
-
-        # Find book
-        for b in self.books:
-            if book_name.lower() in b["title"].lower():
-                book = b
-                break
+        book_name, book = self.find_book("\nEnter the book name to issue: ")
 
         if not book:
             print(f"\nBook {book_name} not found in library")
@@ -269,12 +673,10 @@ class LibraryManagement:
             return
 
         # Check if customer already has this book
-        for issued in self.issued_books:
-            if ((issued["reader_phone"] == reader["phone"]) and
-                    (issued["book_title"] == book["title"]) and
-                    (issued["status"] == "issued")):
-                    print(f"Reader already has {book["title"]} issued")
-                    return
+        for issued in self.open_issues_by_reader.get(reader["phone"], {}).values():
+            if issued["book_id"] == book["id"]:
+                print(f"Reader already has {book["title"]} issued")
+                return
 
         # Issue the book
         issue_date = datetime.now()
@@ -298,23 +700,35 @@ class LibraryManagement:
         }
 
         book["stock"] -= 1
+        self.reindex_book(book)
 
         # Update reader records
-        reader["books_issued"].append({
-            "book_title" : book["title"],
-            "issue_date" : issue_date.strftime("%Y-%m-%d %H:%M"),
-            "status" : "issued"
-        })
+        def record_loan():
+            reader["books_issued"].append({
+                "issue_id" : issue_book_record["issue_id"],
+                "book_id" : book["id"],
+                "book_title" : book["title"],
+                "issue_date" : issue_date.strftime("%Y-%m-%d %H:%M"),
+                "status" : "issued"
+            })
 
-        reader["total_books_issued"] += 1
+            reader["total_books_issued"] += 1
 
         # Add to issued books
         self.issued_books.append(issue_book_record)
+        self.issues_by_id[issue_book_record["issue_id"]] = issue_book_record
+        self.issue_positions[issue_book_record["issue_id"]] = len(self.issued_books) - 1
+        self.track_open_issue(issue_book_record)
+        self.due_scheduler.schedule(issue_book_record)
 
         # Save file to JSON
+        self.mark_ledger_chunks("issued_books", [len(self.issued_books) - 1])
         self.save_books_to_json(self.book_file, self.books)
-        self.save_books_to_json(self.reader_file, self.readers)
+        self.save_readers(record_loan)
         self.save_books_to_json(self.issued_books_file, self.issued_books)
+        self.record_change("insert", "issue", issue_book_record["issue_id"], issue_book_record)
+        self.record_change("update", "book", book["id"], book)
+        self.record_change("update", "reader", reader["reader_id"], reader)
 
         print(f"\nBook '{book['title']}' issued successfully!")
         print(f"Issue ID: {issue_book_record['issue_id']}")
@@ -331,39 +745,133 @@ class LibraryManagement:
         print("2. Author")
         print("3. Genre")
         print("4. Languages")
+        print("5. Browse by filters")
+        print("6. Year/Rating/Price/Pages/Stock range")
 
-        choice = self.get_choice("Enter choice (1-4): ", 1, 4)
+        choice = self.get_choice("Enter choice (1-6): ", 1, 6)
+
+        if choice == 5:
+            self.browse_books()
+            return
+        if choice == 6:
+            self.search_books_by_range()
+            return
 
         if choice == 1:
             search_term = input("Enter book title: ").strip().lower()
-            results = [book for book in self.books if search_term in book["title"].lower()]
+            field = "title"
         elif choice == 2:
             search_term = input("Enter book author name: ").strip().lower()
-            results = [book for book in self.books if search_term in book["author"].lower()]
+            field = "author"
         elif choice == 3:
             search_term = input("Enter book genre: ").strip().lower()
-            results = [book for book in self.books if search_term in book["genre"].lower()]
+            field = "genre"
         elif choice == 4:
             search_term = input("Enter language which book you want: ").strip().lower()
-            results = [book for book in self.books if search_term in book["language"].lower()]
+            field = "language"
         else:
             print("Invalid choice")
             return
 
-        if results:
-            print(f"\nFound {len(results)} book(s):")
+        # Lazily filtered so only the page being shown is materialized
+        results = (book for book in self.books if search_term in book[field].lower())
+
+        def show_book(book):
+            stock_status = f"In stock ({book["stock"]})" if book["stock"] > 0 else "Out of stock"
+            print(f"Title: {book["title"]}")
+            print(f"Author: {book["author"]}")
+            print(f"Genre: {book["genre"]}")
+            print(f"Price: {book["price"]}")
+            print(f"Stock: {stock_status}")
             print("-" * 80)
-            for book in results:
-                stock_status = f"In stock ({book["stock"]})" if book["stock"] > 0 else "Out of stock"
-                print(f"Title: {book["title"]}")
-                print(f"Author: {book["author"]}")
-                print(f"Genre: {book["genre"]}")
-                print(f"Price: {book["price"]}")
-                print(f"Stock: {stock_status}")
-                print("-" * 80)
-        else:
+
+        print("-" * 80)
+        if not self.show_paginated(results, show_book):
+            print("No books found matching your search criteria.")
+
+    """Read an optional numeric range like '1950-1990', '500-' or '-4.5'"""
+    @staticmethod
+    def get_range(prompt):
+        while True:
+            value = input(prompt).strip()
+            if not value:
+                return None
+            low, sep, high = value.partition("-")
+            try:
+                low = float(low) if low.strip() else None
+                high = float(high) if high.strip() else (low if not sep else None)
+                return low, high
+            except ValueError:
+                print("Please enter a range like 100-500, 100- or -500.")
+
+    """Faceted browsing: combine filters and show counts for each facet"""
+    def browse_books(self):
+        print("\n---- BROWSE BOOKS ----")
+        print("Enter filters (press Enter to skip):")
+
+        filters = {
+            "genre" : input("Genre: ").strip(),
+            "language" : input("Language: ").strip(),
+            "author" : input("Author: ").strip(),
+            "year" : self.get_range("Year range (e.g. 1950-1990): "),
+            "rating" : self.get_range("Rating range (e.g. 4-5): "),
+            "price" : self.get_range("Price range (e.g. 0-500): "),
+            "in_stock" : self.get_yes_or_no("Only books in stock? (y/n): ")
+        }
+
+        results, total, counts = self.facet_index.search(filters)
+
+        print(f"\nFound {total} book(s)")
+        facet_titles = {"genre": "Genre", "language": "Language", "author": "Author", "year": "Decade",
+                        "rating": "Rating", "price": "Price band", "in_stock": "In stock"}
+        for facet, title in facet_titles.items():
+            top_values = list(counts[facet].items())[:5]
+            if top_values:
+                print(f"{title}: " + ", ".join(f"{value} ({count})" for value, count in top_values))
+
+        def show_book(book):
+            stock_status = f"In stock ({book["stock"]})" if book["stock"] > 0 else "Out of stock"
+            print(f"{book["title"]} by {book["author"]} | {book["genre"]} | {book["language"]} | "
+                  f"{book["year"]} | Rating: {book["rating"]} | ₹{book["price"]} | {stock_status}")
+
+        print("-" * 80)
+        self.show_paginated(results, show_book)
+
+    """Search books by numeric ranges using the sorted range indexes"""
+    def search_books_by_range(self):
+        print("\nEnter ranges (press Enter to skip):")
+        ranges = {field: self.get_range(f"{field.title()} range: ") for field in self.range_indexes.FIELDS}
+
+        def show_book(book):
+            print(f"{book["title"]} by {book["author"]} | {book["year"]} | Rating: {book["rating"]} | "
+                  f"₹{book["price"]} | {book["pages"]} pages | Stock: {book["stock"]}")
+
+        print("-" * 80)
+        if not self.show_paginated(self.range_indexes.query(ranges), show_book):
             print("No books found matching your search criteria.")
 
+    """Low-stock and restock report served from the stock index"""
+    def stock_report(self):
+        print("\n---- STOCK REPORT ----")
+
+        low_stock = list(self.range_indexes.range("stock", None, self.low_stock_level))
+        if not low_stock:
+            print(f"No books at or below {self.low_stock_level} copies.")
+            return
+
+        out_of_stock = sum(1 for book in low_stock if book["stock"] <= 0)
+        print(f"Books at or below {self.low_stock_level} copies: {len(low_stock)} ({out_of_stock} out of stock)")
+        print("-" * 80)
+
+        restock_cost = 0
+        for book in low_stock:
+            restock_qty = self.restock_level - book["stock"]
+            restock_cost += restock_qty * book["price"]
+            print(f"{book["title"]} by {book["author"]}")
+            print(f"  Stock: {book["stock"]} | Restock to {self.restock_level}: order {restock_qty} copies")
+        print("-" * 80)
+        print(f"Estimated restock cost: ₹{restock_cost}")
+
     """Add a new book to the library"""
     def add_new_books(self):
         print("\n---- ADD NEW BOOKS ----")
@@ -395,6 +903,7 @@ class LibraryManagement:
                 "rating" : rating,
                 "language" : language,
                 "stock" : stock,
+                "total_copies" : stock,
                 "price" : price
             }
 
@@ -403,11 +912,11 @@ class LibraryManagement:
                 continue
 
             """Save new book to JSON file"""
-            self.books.append(new_book)
-            self.books_index[title.lower()] = new_book
+            self.catalog_book(new_book)
             nex_id += 1  # Increment for next book
 
             if self.save_books_to_json(self.book_file, self.books):
+                self.record_change("insert", "book", new_book["id"], new_book)
                 print(f"Book '{title}' added successfully with ID: {nex_id - 1}")
             else:
                 print("Error adding book")
@@ -416,13 +925,7 @@ class LibraryManagement:
     def update_books(self):
         print("\n--- UPDATE BOOK ---")
 
-        book_title = input("Enter the book title: ").strip()
-        book = None
-
-        for b in self.books:
-            if book_title.lower() in b["title"].lower():
-                book = b
-                break
+        book_title, book = self.find_book("Enter the book title: ")
 
         if not book:
             print(f"Book '{book_title}' not found")
@@ -432,6 +935,7 @@ class LibraryManagement:
         for key, value in book.items():
             print(f"{key}: {value}")
 
+        old_title = book["title"]
         print("\nEnter new values (press Enter to keep current value):")
         fields_to_update = ["title", "author", "year", "genre", "pages", "isbn", "rating", "language", "stock", "price"]
 
@@ -440,14 +944,33 @@ class LibraryManagement:
             new_value = input(f"{filed} [{current_value}]: ").strip()
 
             if new_value:
-                if filed in ["year", "pages", "stock", "price"]:
+                if filed == "stock":
+                    # Setting the shelf count adds or writes off copies, so the owned total moves with it
+                    new_stock = int(new_value)
+                    book["total_copies"] = book.get("total_copies", book["stock"]) + new_stock - book["stock"]
+                    book["stock"] = new_stock
+                elif filed in ["year", "pages", "price"]:
                     book[filed] = int(new_value)
                 elif filed == "rating":
                     book[filed] = float(new_value)
+                elif filed == "isbn":
+                    isbn = canonical_isbn(new_value)
+                    if not isbn:
+                        print(f"Invalid ISBN '{new_value}', keeping {current_value}")
+                    elif self.books_by_isbn.get(isbn, book) is not book:
+                        print(f"ISBN {isbn} already belongs to '{self.books_by_isbn[isbn]['title']}', keeping {current_value}")
+                    else:
+                        book[filed] = isbn
                 else:
                     book[filed] = new_value
 
+        # Keep title lookups in sync with renamed titles
+        self.books_index.pop(old_title.lower(), None)
+        self.books_index[book["title"].lower()] = book
+        self.reindex_book(book)
+
         if self.save_books_to_json(self.book_file, self.books):
+            self.record_change("update", "book", book["id"], book)
             print(f"Book '{book["title"]}' updated successfully!")
         else:
             print("Error Updating Book")
@@ -456,33 +979,27 @@ class LibraryManagement:
     def delete_book(self):
         print("\n---- DELETE BOOK ----")
 
-        book_title = input("Enter book title to delete from library: ").strip()
-        book_to_delete = None
-        book_index = -1
-
-        for i, book in enumerate(self.books):
-            if book_title.lower() in book["title"].lower():
-                book_to_delete = book
-                book_index = i
-                break
+        book_title, book_to_delete = self.find_book("Enter book title to delete from library: ")
 
         if not book_to_delete:
             print(f"Book '{book_title}' not found!")
             return
 
-        for issued in self.issued_books:
-            if issued["book_title"] == book_to_delete["title"] and issued["status"] == "issued":
-                print(f"Cannot delete '{book_to_delete["title"]}' - currently issued to a reader ")
-                return
+        if self.open_issues_by_book.get(book_to_delete["id"]):
+            print(f"Cannot delete '{book_to_delete["title"]}' - currently issued to a reader ")
+            return
 
         confirmation = self.get_yes_or_no(f"Are you sure you want to delete '{book_to_delete["title"]}'? (y/n): ")
 
         if confirmation:
-            del self.books[book_index]
+            self.books.remove(book_to_delete)
             if book_to_delete["title"].lower() in self.books_index:
                 del self.books_index[book_to_delete["title"].lower()]
+            self.books_by_id.pop(book_to_delete["id"], None)
+            self.unindex_book(book_to_delete)
 
             if self.save_books_to_json(self.book_file, self.books):
+                self.record_change("delete", "book", book_to_delete["id"], book_to_delete)
                 print(f"Book '{book_to_delete["title"]}' deleted successfully!")
             else:
                 print("Error deleting book")
@@ -490,8 +1007,17 @@ class LibraryManagement:
             print("Book deletion cancelled")
 
     """Process payment with different methods"""
-    def process_payment(self, amount, payment_type, reader_phone, description):
+    def process_payment(self, amount, payment_type, reader_phone, description, idempotency_key=None):
         print("\n---- PAYMENT PROCESSING ----")
+
+        # A retried payment with the same key must not charge the reader twice
+        existing = self.payments_by_key.get(idempotency_key) if idempotency_key else None
+        if existing:
+            print("This payment has already been recorded - not charging again.")
+            print(f"Payment ID: {existing['payment_id']}")
+            print(f"Transaction Reference: {existing['transaction_ref']}")
+            return True
+
         print(f"Amount to Pay: ₹{amount}")
         print(f"Payment Type: {payment_type}")
         print(f"Description: {description}")
@@ -532,7 +1058,7 @@ class LibraryManagement:
 
         # Create payment record
         payment_record = {
-            "payment_id" : self.generate_payment_id(),
+            "payment_id" : self.generate_unique_payment_id(),
             "reader_phone" : reader_phone,
             "amount": amount,
             "payment_method" : payment_method,
@@ -540,11 +1066,16 @@ class LibraryManagement:
             "description" : description,
             "payment_date" : datetime.now().strftime("%Y-%m-%d"),
             "status" : payment_status,
-            "transaction_ref" : f"TXN{random.randint(100000, 999999)}"
+            "transaction_ref" : self.generate_transaction_ref()
         }
+        if idempotency_key:
+            payment_record["idempotency_key"] = idempotency_key
 
         self.payments.append(payment_record)
+        self.index_payment(payment_record, len(self.payments) - 1)
+        self.mark_ledger_chunks("payments", [len(self.payments) - 1])
         self.save_books_to_json(self.payment_file, self.payments)
+        self.record_change("insert", "payment", payment_record["payment_id"], payment_record)
 
         print(f"\nPayment Successful!")
         print(f"Payment ID: {payment_record['payment_id']}")
@@ -553,6 +1084,85 @@ class LibraryManagement:
 
         return True
 
+    """Record a batch of settled payments in one write, rejecting duplicates"""
+    def settle_payments(self, records):
+        accepted = []
+        rejected = []
+        seen_refs = set()
+        seen_keys = set()
+
+        for record in records:
+            transaction_ref = str(record.get("transaction_ref") or "").strip()
+            idempotency_key = str(record.get("idempotency_key") or "").strip() or None
+            try:
+                amount = float(record.get("amount"))
+            except (TypeError, ValueError):
+                rejected.append((record, "invalid amount"))
+                continue
+
+            if not transaction_ref:
+                rejected.append((record, "missing transaction_ref"))
+                continue
+            if transaction_ref in self.payments_by_ref or transaction_ref in seen_refs:
+                rejected.append((record, "duplicate transaction_ref"))
+                continue
+            if idempotency_key and (idempotency_key in self.payments_by_key or idempotency_key in seen_keys):
+                rejected.append((record, "duplicate idempotency_key"))
+                continue
+
+            payment_method = record.get("payment_method") or "UPI"
+            payment_record = {
+                "payment_id" : record.get("payment_id") or self.generate_unique_payment_id(),
+                "reader_phone" : str(record.get("reader_phone", "")).strip(),
+                "amount" : int(amount) if amount.is_integer() else amount,
+                "payment_method" : payment_method,
+                "payment_type" : record.get("payment_type") or "Settlement",
+                "description" : record.get("description") or f"{payment_method} settlement",
+                "payment_date" : record.get("payment_date") or datetime.now().strftime("%Y-%m-%d"),
+                "status" : record.get("status") or "Completed",
+                "transaction_ref" : transaction_ref
+            }
+            if payment_record["payment_id"] in self.payments_by_id:
+                rejected.append((record, "duplicate payment_id"))
+                continue
+            if idempotency_key:
+                payment_record["idempotency_key"] = idempotency_key
+                seen_keys.add(idempotency_key)
+            seen_refs.add(transaction_ref)
+
+            self.payments.append(payment_record)
+            self.index_payment(payment_record, len(self.payments) - 1)
+            accepted.append(payment_record)
+
+        # One write for the whole batch
+        if accepted:
+            self.mark_ledger_chunks("payments", range(len(self.payments) - len(accepted), len(self.payments)))
+            self.save_books_to_json(self.payment_file, self.payments)
+            for payment_record in accepted:
+                self.record_change("insert", "payment", payment_record["payment_id"], payment_record)
+
+        return accepted, rejected
+
+    """Import an end-of-day card/UPI export (CSV with a header row, JSON list or JSONL)"""
+    def import_settlement_file(self, filename):
+        try:
+            with open(filename, "r", newline="") as f:
+                if filename.lower().endswith(".csv"):
+                    records = list(csv.DictReader(f))
+                elif filename.lower().endswith(".jsonl"):
+                    records = [json.loads(line) for line in f if line.strip()]
+                else:
+                    records = json.load(f)
+        except Exception as e:
+            print(f"Error loading {filename}: {e}")
+            return [], []
+
+        accepted, rejected = self.settle_payments(records)
+        print(f"Settlement {filename}: {len(accepted)} payment(s) recorded, {len(rejected)} rejected")
+        for record, reason in rejected:
+            print(f"  Rejected {record.get('transaction_ref', '?')}: {reason}")
+        return accepted, rejected
+
     """Check and process membership"""
     def check_membership_status(self, reader):
         active_membership = None
@@ -602,7 +1212,17 @@ class LibraryManagement:
         plan_details = self.membership_plans[plan_choice]
         amount = plan_details["fee"]
 
-        if self.process_payment(amount, "Membership Fee", reader["phone"], f"{plan_choice} Membership"):
+        purpose = f"membership:{plan_choice}"
+        idempotency_key = self.begin_payment_attempt(reader["phone"], purpose)
+
+        # A retry is not charged again by process_payment; it only finishes what the first attempt left undone
+        if self.process_payment(amount, "Membership Fee", reader["phone"], f"{plan_choice} Membership", idempotency_key):
+            created = next((m for m in self.memberships if m.get("idempotency_key") == idempotency_key), None)
+            if created:
+                self.finish_payment_attempt(reader["phone"], purpose)
+                print(f"\n{plan_choice} Membership is already active (ID: {created['membership_id']})")
+                return
+
             start_date = datetime.now()
             expiry_date = start_date + timedelta(days=plan_details["duration_months"] * 30)
 
@@ -615,16 +1235,23 @@ class LibraryManagement:
                 "expiry_date" : expiry_date.strftime("%Y-%m-%d"),
                 "status" : "active",
                 "book_limit" : plan_details["book_limit"],
-                "discount" : plan_details["discount"]
+                "discount" : plan_details["discount"],
+                "idempotency_key" : idempotency_key
             }
 
             # Deactivate old membership if exists
+            replaced = []
             for membership in self.memberships:
                 if membership["reader_phone"] == reader["phone"]:
                     membership["status"] = "replaced"
+                    replaced.append(membership)
 
             self.memberships.append(membership_record)
             self.save_books_to_json(self.membership_file, self.memberships)
+            for membership in replaced:
+                self.record_change("update", "membership", membership["membership_id"], membership)
+            self.record_change("insert", "membership", membership_record["membership_id"], membership_record)
+            self.finish_payment_attempt(reader["phone"], purpose)
 
             print(f"\n{plan_choice} Membership activated successfully!")
             print(f"Membership ID: {membership_record['membership_id']}")
@@ -675,20 +1302,37 @@ class LibraryManagement:
                 print(f"• {book['title']}: {book['overdue_days']} days overdue - ₹{book['fine']}")
 
         if self.get_yes_or_no(f"Pay fine of ₹{pending_fine}? (y/n): "):
-            if self.process_payment(pending_fine, "Fine Payment", reader["phone"], "Overdue book fine"):
-                reader["pending_fine"] = 0
-                reader["total_fine_paid"] = reader.get("total_fine_paid", 0) + pending_fine
+            idempotency_key = self.begin_payment_attempt(reader["phone"], "fine")
+
+            # A retry is not charged again by process_payment, and the reader is only credited once
+            if self.process_payment(pending_fine, "Fine Payment", reader["phone"], "Overdue book fine", idempotency_key):
+                def credit_fine():
+                    if reader.get("last_fine_payment") != idempotency_key:
+                        reader["pending_fine"] = 0
+                        # Credit what was actually charged, which a retry on a later day may differ from
+                        reader["total_fine_paid"] = (reader.get("total_fine_paid", 0) +
+                                                     self.payments_by_key[idempotency_key]["amount"])
+                        reader["last_fine_payment"] = idempotency_key
 
                 # Update issued books fine status
-                for issued_book in self.issued_books:
+                fined_positions = []
+                fined_issues = []
+                for position, issued_book in enumerate(self.issued_books):
                     if issued_book["reader_phone"] == reader["phone"] and issued_book["status"] == "issued":
                         expected_return = datetime.strptime(issued_book["return_date"], "%Y-%m-%d %H:%M")
                         if datetime.now() > expected_return:
                             overdue_days = (datetime.now() - expected_return).days
                             issued_book["fine_amount"] = overdue_days * 5
+                            fined_positions.append(position)
+                            fined_issues.append(issued_book)
 
-                self.save_books_to_json(self.reader_file, self.readers)
+                self.mark_ledger_chunks("issued_books", fined_positions)
+                self.save_readers(credit_fine)
                 self.save_books_to_json(self.issued_books_file, self.issued_books)
+                self.record_change("update", "reader", reader["reader_id"], reader)
+                for issued_book in fined_issues:
+                    self.record_change("update", "issue", issued_book["issue_id"], issued_book)
+                self.finish_payment_attempt(reader["phone"], "fine")
 
                 print("Fine paid successfully!")
 
@@ -701,13 +1345,7 @@ class LibraryManagement:
             return
 
         # Search for book
-        book_name = input("Enter the book name to purchase: ").strip()
-        book = None
-
-        for b in self.books:
-            if book_name.lower() in b["title"].lower():
-                book = b
-                break
+        book_name, book = self.find_book("Enter the book name to purchase: ")
 
         if not book:
             print(f"Book '{book_name}' not found in library")
@@ -729,7 +1367,11 @@ class LibraryManagement:
             print(f"Final Price: ₹{final_price}")
 
         if self.get_yes_or_no(f"Confirm purchase for ₹{final_price}? (y/n): "):
-            if self.process_payment(final_price, "Book Purchase", reader["phone"], f"Purchase: {book['title']}"):
+            purpose = f"book:{book['id']}"
+            idempotency_key = self.begin_payment_attempt(reader["phone"], purpose)
+            if self.process_payment(final_price, "Book Purchase", reader["phone"], f"Purchase: {book['title']}",
+                                    idempotency_key):
+                self.finish_payment_attempt(reader["phone"], purpose)
                 print(f"\nBook '{book['title']}' purchased successfully!")
                 print("Thank you for your purchase!")
 
@@ -741,19 +1383,11 @@ class LibraryManagement:
         if not reader:
             return
 
-        # Get reader's payment history
-        reader_payments = [payment for payment in self.payments
-                           if payment["reader_phone"] == reader["phone"]]
+        # Newest first by payment date, not by the order the records were appended in
+        reader_index = self.payments_by_reader.get(reader["phone"], SortedIndex())
+        reader_payments = (self.payments[position] for _, position in reader_index.range(reverse=True))
 
-        if not reader_payments:
-            print("No payment history found.")
-            return
-
-        print(f"\nPayment History for {reader['name']}:")
-        print("-" * 80)
-
-        total_paid = 0
-        for payment in sorted(reader_payments, key=lambda x: x["payment_date"], reverse=True):
+        def show_payment(payment):
             print(f"Payment ID: {payment['payment_id']}")
             print(f"Date: {payment['payment_date']}")
             print(f"Type: {payment['payment_type']}")
@@ -762,21 +1396,29 @@ class LibraryManagement:
             print(f"Status: {payment['status']}")
             print(f"Description: {payment['description']}")
             print("-" * 80)
-            total_paid += payment['amount']
 
+        print(f"\nPayment History for {reader['name']}:")
+        print("-" * 80)
+
+        if not self.show_paginated(reader_payments, show_payment):
+            print("No payment history found.")
+            return
+
+        total_paid = sum(self.payments[position]["amount"] for _, position in reader_index.range())
         print(f"Total Amount Paid: ₹{total_paid}")
 
     """Process book return"""
     def return_book(self):
         print("\n---- RETURN BOOK ----")
 
-        phone = self.get_phone()
+        _, reader = self.find_reader()
+        if not reader:
+            print("Reader not found")
+            return
+        phone = reader["phone"]
 
         # Find customer's issued books
-        reader_issued_book = [
-            book for book in self.issued_books
-            if book["reader_phone"] == phone and book["status"] == "issued"
-        ]
+        reader_issued_book = list(self.open_issues_by_reader.get(phone, {}).values())
 
         if not reader_issued_book:
             print("No books currently issued to this reader")
@@ -813,36 +1455,39 @@ class LibraryManagement:
                     fine_amount = overdue_days * 5
 
                 # Update the issued book record
-                for issue_book in self.issued_books:
-                    if issue_book["issue_id"] == book_to_return["issue_id"]:
-                        issue_book["actual_return_date"] = datetime.now().strftime("%Y-%m-%d %H:%M")
-                        issue_book["status"] = "returned"
-                        issue_book["fine_amount"] = fine_amount
-                        break
+                book_to_return["actual_return_date"] = datetime.now().strftime("%Y-%m-%d %H:%M")
+                book_to_return["status"] = "returned"
+                book_to_return["fine_amount"] = fine_amount
+                self.untrack_open_issue(book_to_return)
 
                 # Update book stock
-                for book in self.books:
-                    if book["title"] == book_to_return["book_title"]:
-                        book["stock"] += 1
-                        break
+                restocked_book = self.books_by_id.get(book_to_return["book_id"])
+                if restocked_book:
+                    restocked_book["stock"] += 1
+                    self.reindex_book(restocked_book)
 
                 # Update customer record
-                reader = self.reader_index[phone]
-                self.fix_missing_fields(reader)
-
-                for book_record in reader["books_issued"]:
-                    if book_record["book_title"] == book_to_return["book_title"] and book_record["status"] == "issued":
-                        book_record["status"] = "returned"
-                        book_record["return_date"] = datetime.now().strftime("%Y-%m-%d %H:%M")
-                        reader["total_books_issued"] -= 1
-                        if fine_amount > 0:
-                            book_record["fine_paid"] = fine_amount
-                        break
+                def record_return():
+                    self.fix_missing_fields(reader)
+
+                    for book_record in reader["books_issued"]:
+                        if book_record.get("issue_id") == book_to_return["issue_id"] and book_record["status"] == "issued":
+                            book_record["status"] = "returned"
+                            book_record["return_date"] = datetime.now().strftime("%Y-%m-%d %H:%M")
+                            reader["total_books_issued"] -= 1
+                            if fine_amount > 0:
+                                book_record["fine_paid"] = fine_amount
+                            break
 
                 # Save date to JSON file
+                self.mark_ledger_chunks("issued_books", [self.issue_positions[book_to_return["issue_id"]]])
                 self.save_books_to_json(self.book_file, self.books)
-                self.save_books_to_json(self.reader_file, self.readers)
+                self.save_readers(record_return)
                 self.save_books_to_json(self.issued_books_file, self.issued_books)
+                self.record_change("update", "issue", book_to_return["issue_id"], book_to_return)
+                if restocked_book:
+                    self.record_change("update", "book", restocked_book["id"], restocked_book)
+                self.record_change("update", "reader", reader["reader_id"], reader)
 
                 print(f"\nBook '{book_to_return["book_title"]}' returned successfully!")
                 if fine_amount > 0:
@@ -856,13 +1501,13 @@ class LibraryManagement:
     def view_readers_profile(self):
         print("\n---- READER PROFILE ----")
 
-        phone = self.get_phone()
+        _, reader = self.find_reader()
 
-        if phone not in self.reader_index:
+        if not reader:
             print("Reader not found")
             return
 
-        reader = self.reader_index[phone]
+        phone = reader["phone"]
         self.fix_missing_fields(reader)
 
         print("\n---- Reader Details ----")
@@ -917,15 +1562,17 @@ class LibraryManagement:
     def view_issued_books(self):
         print("\n---- ALL ISSUED BOOKS ----")
 
-        current_issue = [book for book in self.issued_books if book["status"] == "issued"]
-
-        if not current_issue:
+        if not self.due_index:
             print("No books currently issued")
             return
 
-        print(f"Total Issued Books: {len(current_issue)}\n")
+        print(f"Total Issued Books: {len(self.due_index)}\n")
+        print("Sort By:")
+        print("1. Most overdue first")
+        print("2. Latest due date first")
+        most_overdue_first = self.get_choice("Enter choice (1-2): ", 1, 2) == 1
 
-        for book in current_issue:
+        def show_issue(book):
             expected_return = datetime.strptime(book["return_date"], "%Y-%m-%d %H:%M")
             days_remaining = (expected_return - datetime.now()).days
 
@@ -940,42 +1587,66 @@ class LibraryManagement:
                 print(f"Status: {days_remaining} days remaining")
             print("-" * 50)
 
-    """Main program loop"""
-    def run(self):
+        self.show_paginated(self.iter_issued_books(most_overdue_first), show_issue)
+
+    """Run one menu operation; returns False when the user chose Exit"""
+    def perform(self, choice):
+        if choice == 1:
+            self.search_books()
+        elif choice == 2:
+            self.issued_book()
+        elif choice == 3:
+            self.add_new_books()
+        elif choice == 4:
+            self.update_books()
+        elif choice == 5:
+            self.delete_book()
+        elif choice == 6:
+            self.return_book()
+        elif choice == 7:
+            self.view_readers_profile()
+        elif choice == 8:
+            self.view_issued_books()
+        elif choice == 9:
+            self.purchase_book()
+        elif choice == 10:
+            self.purchase_membership()
+        elif choice == 11:
+            self.view_payment_history()
+        elif choice == 12:
+            self.stock_report()
+        elif choice == 13:
+            print("Thank you for using Library Management System!")
+            return False
+        else:
+            print("Invalid choice! Please enter a number between 1-13.")
+        return True
+
+    """Main program loop; a WorkloadRecorder captures each operation when given"""
+    def run(self, recorder=None):
         print("Welcome to Library Management System!")
 
         while True:
+            self.due_scheduler.tick()
             self.display_menu()
-            choice = self.get_choice("Enter your choice (1-9): ", 1, 12)
-
-            if choice == 1:
-                self.search_books()
-            elif choice == 2:
-                self.issued_book()
-            elif choice == 3:
-                self.add_new_books()
-            elif choice == 4:
-                self.update_books()
-            elif choice == 5:
-                self.delete_book()
-            elif choice == 6:
-                self.return_book()
-            elif choice == 7:
-                self.view_readers_profile()
-            elif choice == 8:
-                self.view_issued_books()
-            elif choice == 9:
-                self.purchase_book()
-            elif choice == 10:
-                self.purchase_membership()
-            elif choice == 11:
-                self.view_payment_history()
-            elif choice == 12:
-                print("Thank you for using Library Management System!")
+            choice = self.get_choice("Enter your choice (1-13): ", 1, 13)
+
+            if recorder:
+                recorder.begin(choice)
+            keep_running = self.perform(choice)
+            if recorder:
+                recorder.end()
+            if not keep_running:
                 break
-            else:
-                print("Invalid choice! Please enter a number between 1-12.")
 
 if __name__ == "__main__":
     library_system = LibraryManagement()
-    library_system.run()
\ No newline at end of file
+    if len(sys.argv) > 2 and sys.argv[1] == "--settle":
+        for settlement_file in sys.argv[2:]:
+            library_system.import_settlement_file(settlement_file)
+    elif len(sys.argv) > 2 and sys.argv[1] == "--record":
+        from workload_replay import WorkloadRecorder
+        with WorkloadRecorder(sys.argv[2], library=library_system) as recorder:
+            library_system.run(recorder)
+    else:
+        library_system.run()
\ No newline at end of file
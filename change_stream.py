@@ -0,0 +1,120 @@
+from datetime import datetime
+import bisect
+import json
+import os
+import sys
+
+
+class ChangeStream:
+    """Sequenced change events written to rotating JSONL segments"""
+
+    def __init__(self, log_dir="changes", segment_size=1000):
+        self.log_dir = log_dir
+        self.segment_size = segment_size
+        self.offset_file = os.path.join(log_dir, "offsets.json")
+        os.makedirs(log_dir, exist_ok=True)
+
+        # Segments are named after their first sequence number
+        self.segments = sorted(int(name[8:-6]) for name in os.listdir(log_dir)
+                               if name.startswith("changes-") and name.endswith(".jsonl"))
+        self.last_seq = 0
+        self.segment_count = 0
+        if self.segments:
+            with open(self.segment_path(self.segments[-1]), "r") as f:
+                for line in f:
+                    if line.strip():
+                        self.last_seq = json.loads(line)["seq"]
+                        self.segment_count += 1
+
+    """File name of the segment starting at first_seq"""
+    def segment_path(self, first_seq):
+        return os.path.join(self.log_dir, f"changes-{first_seq:012d}.jsonl")
+
+    """Append one change event and return its sequence number"""
+    def append(self, op, entity, key, data):
+        seq = self.last_seq + 1
+        if not self.segments or self.segment_count >= self.segment_size:
+            self.segments.append(seq)
+            self.segment_count = 0
+
+        event = {
+            "seq" : seq,
+            "ts" : datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "op" : op,
+            "entity" : entity,
+            "key" : key,
+            "data" : data
+        }
+        try:
+            with open(self.segment_path(self.segments[-1]), "a") as f:
+                f.write(json.dumps(event) + "\n")
+        except Exception as e:
+            print(f"Error saving change event {seq}: {e}")
+            return None
+
+        self.last_seq = seq
+        self.segment_count += 1
+        return seq
+
+    """Yield events with seq greater than after_seq, starting from the right segment"""
+    def read_from(self, after_seq=0):
+        start = max(bisect.bisect_right(self.segments, after_seq + 1) - 1, 0)
+        for first_seq in self.segments[start:]:
+            with open(self.segment_path(first_seq), "r") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    event = json.loads(line)
+                    if event["seq"] > after_seq:
+                        yield event
+
+    """Load committed consumer offsets"""
+    def load_offsets(self):
+        try:
+            if os.path.exists(self.offset_file):
+                with open(self.offset_file, "r") as f:
+                    return json.load(f)
+        except Exception as e:
+            print(f"Error loading {self.offset_file}: {e}")
+        return {}
+
+    """Commit the last processed sequence number for a consumer"""
+    def commit_offset(self, consumer, seq):
+        offsets = self.load_offsets()
+        offsets[consumer] = seq
+        with open(self.offset_file, "w") as f:
+            json.dump(offsets, f, indent=4)
+
+    """Yield new events for a consumer and commit its offset once they are consumed"""
+    def tail(self, consumer):
+        last_seq = self.load_offsets().get(consumer, 0)
+        for event in self.read_from(last_seq):
+            yield event
+            last_seq = event["seq"]
+        self.commit_offset(consumer, last_seq)
+
+
+"""Command line tail/replay tool for downstream consumers"""
+def main(args):
+    usage = ("Usage: python change_stream.py tail <consumer> [log_dir]\n"
+             "       python change_stream.py replay <from_seq> [log_dir]")
+    if len(args) < 2 or args[0] not in ["tail", "replay"]:
+        print(usage)
+        return 1
+
+    stream = ChangeStream(args[2] if len(args) > 2 else "changes")
+    if args[0] == "tail":
+        events = stream.tail(args[1])
+    else:
+        if not args[1].isdigit():
+            print(usage)
+            return 1
+        events = stream.read_from(int(args[1]) - 1)
+
+    for event in events:
+        print(json.dumps(event))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
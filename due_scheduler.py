@@ -0,0 +1,149 @@
+from datetime import datetime, timedelta
+import heapq
+import itertools
+import json
+import os
+import sys
+
+
+class DueDateScheduler:
+    """Time-ordered queue of reminder and overdue events for open loans"""
+
+    def __init__(self, issued_books, outbox_file="reminder_outbox.jsonl", state_file="reminder_state.json",
+                 reminder_offsets=(2, 0), overdue_offsets=(1, 7)):
+        self.outbox_file = outbox_file
+        self.state_file = state_file
+        self.reminder_offsets = reminder_offsets  # days before return_date
+        self.overdue_offsets = overdue_offsets  # days after return_date
+        self.heap = []
+        self.counter = itertools.count()
+
+        # Events at or before the last tick were already emitted by a previous run
+        state = self.load_state()
+        self.last_tick = datetime.strptime(state["last_tick"], "%Y-%m-%d %H:%M") if state.get("last_tick") else None
+
+        for issued in issued_books:
+            if issued["status"] == "issued":
+                self.schedule(issued)
+
+    """Load scheduler state from file"""
+    def load_state(self):
+        try:
+            if os.path.exists(self.state_file):
+                with open(self.state_file, "r") as f:
+                    return json.load(f)
+        except Exception as e:
+            print(f"Error loading {self.state_file}: {e}")
+        return {}
+
+    """Save scheduler state to file"""
+    def save_state(self):
+        try:
+            with open(self.state_file, "w") as f:
+                json.dump({"last_tick": self.last_tick.strftime("%Y-%m-%d %H:%M")}, f, indent=4)
+        except Exception as e:
+            print(f"Error saving {self.state_file}: {e}")
+
+    """Push reminder and overdue events for a newly issued book"""
+    def schedule(self, issued):
+        try:
+            due = datetime.strptime(issued["return_date"], "%Y-%m-%d %H:%M")
+        except ValueError:
+            print(f"Invalid date format in issued book ID: {issued.get('issue_id')}")
+            return
+
+        events = [("reminder", due - timedelta(days=days)) for days in self.reminder_offsets]
+        events += [("overdue", due + timedelta(days=days)) for days in self.overdue_offsets]
+
+        # When catching up, only the most recent missed event per loan is worth sending
+        missed = [fire_at for _, fire_at in events if fire_at <= datetime.now()]
+        latest_missed = max(missed) if missed else None
+
+        for kind, fire_at in events:
+            if self.last_tick and fire_at <= self.last_tick:
+                continue
+            if latest_missed and fire_at < latest_missed:
+                continue
+            heapq.heappush(self.heap, (fire_at, next(self.counter), kind, issued))
+
+    """Pop every event that is due and write it to the outbox"""
+    def tick(self, now=None):
+        now = now or datetime.now()
+        events = []
+
+        while self.heap and self.heap[0][0] <= now:
+            fire_at, _, kind, issued = heapq.heappop(self.heap)
+            # Returned loans are dropped lazily instead of being removed from the heap
+            if issued["status"] != "issued":
+                continue
+            events.append(self.build_event(kind, fire_at, issued, now))
+
+        if events:
+            try:
+                with open(self.outbox_file, "a") as f:
+                    for event in events:
+                        f.write(json.dumps(event) + "\n")
+            except Exception as e:
+                print(f"Error saving {self.outbox_file}: {e}")
+
+            self.last_tick = now
+            self.save_state()
+        return events
+
+    """Build an outbox record for the mailer"""
+    @staticmethod
+    def build_event(kind, fire_at, issued, now):
+        if kind == "reminder":
+            message = f"Reminder: '{issued['book_title']}' is due on {issued['return_date']}."
+        else:
+            overdue_days = (now - datetime.strptime(issued["return_date"], "%Y-%m-%d %H:%M")).days
+            message = (f"Overdue: '{issued['book_title']}' was due on {issued['return_date']} "
+                       f"(fine so far: ₹{overdue_days * 5}).")
+
+        return {
+            "event" : kind,
+            "issue_id" : issued["issue_id"],
+            "reader_id" : issued["reader_id"],
+            "reader_name" : issued["reader_name"],
+            "reader_phone" : issued["reader_phone"],
+            "book_title" : issued["book_title"],
+            "return_date" : issued["return_date"],
+            "scheduled_for" : fire_at.strftime("%Y-%m-%d %H:%M"),
+            "created_at" : now.strftime("%Y-%m-%d %H:%M"),
+            "message" : message
+        }
+
+
+"""Local mailer stand-in: deliver outbox events of one data directory written since the last run"""
+def deliver_outbox(data_dir="."):
+    outbox_file = os.path.join(data_dir, "reminder_outbox.jsonl")
+    offset_file = os.path.join(data_dir, "reminder_outbox.offset")
+    offset = 0
+    if os.path.exists(offset_file):
+        with open(offset_file, "r") as f:
+            offset = int(f.read().strip() or 0)
+
+    if not os.path.exists(outbox_file):
+        print(f"Outbox {outbox_file} is empty")
+        return 0
+
+    delivered = 0
+    with open(outbox_file, "rb") as f:
+        f.seek(offset)
+        for line in f:
+            event = json.loads(line)
+            print(f"To {event['reader_name']} ({event['reader_phone']}): {event['message']}")
+            delivered += 1
+        offset = f.tell()
+
+    with open(offset_file, "w") as f:
+        f.write(str(offset))
+
+    print(f"Delivered {delivered} message(s) from {outbox_file}")
+    return delivered
+
+
+if __name__ == "__main__":
+    # Each branch keeps its own outbox, e.g. python due_scheduler.py branches/*/
+    for data_dir in sys.argv[1:] or ["."]:
+        deliver_outbox(data_dir)
@@ -0,0 +1,224 @@
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+import os
+import sys
+
+from Library_Management import LibraryManagement
+from library_branches import MultiBranchLibrary
+
+
+"""Partial aggregates for one chunk of issue records; runs in a worker process"""
+def aggregate_issues(chunk):
+    open_by_book = Counter()
+    open_by_reader = Counter()
+    for issued in chunk:
+        if issued.get("status") == "issued":
+            open_by_book[str(issued.get("book_id"))] += 1
+            open_by_reader[issued.get("reader_phone")] += 1
+    return {"open_by_book" : dict(open_by_book), "open_by_reader" : dict(open_by_reader)}
+
+
+"""Partial aggregates for one chunk of payment records; runs in a worker process"""
+def aggregate_payments(chunk):
+    fines_by_reader = Counter()
+    for payment in chunk:
+        if payment.get("payment_type") == "Fine Payment" and payment.get("status") == "Completed":
+            fines_by_reader[payment.get("reader_phone")] += payment.get("amount", 0)
+    return {"fines_by_reader" : dict(fines_by_reader)}
+
+
+class IntegrityChecker:
+    """Recomputes counters from the ledgers and reports or repairs drift"""
+
+    def __init__(self, library, state_file=None, workers=None, full=False, other_branches=None):
+        self.library = library
+        self.state_file = state_file or os.path.join(library.data_dir, "integrity_state.json")
+        self.workers = workers
+        self.full = full
+        # Branches share one reader file, so reader counters are only checkable across all of their ledgers
+        self.other_branches = other_branches or []
+        shared_readers = os.path.dirname(os.path.abspath(library.reader_file)) != os.path.abspath(library.data_dir)
+        self.skip_readers = shared_readers and other_branches is None
+        self.state = LibraryManagement.load_library_data(self.state_file, {})
+        self.recomputed_chunks = 0
+        self.reused_chunks = 0
+
+    """Aggregate a ledger chunk by chunk, reusing cached results for chunks the app has not written since"""
+    def aggregate(self, name, lib, ledger, func):
+        records = getattr(lib, ledger)
+        size = lib.ledger_chunk_size
+        epoch = lib.ledger_versions["epoch"]
+        versions = lib.ledger_versions.get(ledger, [])
+        cache = self.state.get("chunks", {}).get(name, [])
+        chunks = [records[i:i + size] for i in range(0, len(records), size)]
+        chunk_versions = [versions[i] if i < len(versions) else 0 for i in range(len(chunks))]
+
+        # Chunk versions are bumped at write time, so reuse needs no pass over the records
+        results = [None] * len(chunks)
+        stale = []
+        for i, version in enumerate(chunk_versions):
+            cached = cache[i] if i < len(cache) else None
+            if (not self.full and cached and cached["epoch"] == epoch and cached["version"] == version
+                    and cached["count"] == len(chunks[i])):
+                results[i] = cached["result"]
+                self.reused_chunks += 1
+            else:
+                stale.append(i)
+
+        # Only changed chunks are recomputed, in parallel when there are several
+        if len(stale) > 1 and self.workers != 1:
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                for i, result in zip(stale, pool.map(func, [chunks[i] for i in stale])):
+                    results[i] = result
+        else:
+            for i in stale:
+                results[i] = func(chunks[i])
+        self.recomputed_chunks += len(stale)
+
+        self.state.setdefault("chunks", {})[name] = [{"epoch": epoch, "version": version, "count": len(chunk),
+                                                      "result": result}
+                                                     for version, chunk, result in zip(chunk_versions, chunks, results)]
+
+        totals = {}
+        for result in results:
+            for key, counts in result.items():
+                merged = totals.setdefault(key, Counter())
+                merged.update(counts)
+        return totals
+
+    """Compare counters against the ledgers; returns a list of discrepancies"""
+    def check(self, repair=False):
+        lib = self.library
+        issues = self.aggregate("issued_books", lib, "issued_books", aggregate_issues)
+        payments = self.aggregate("payments", lib, "payments", aggregate_payments)
+        open_by_book = issues.get("open_by_book", Counter())
+        open_by_reader = issues.get("open_by_reader", Counter())
+        fines_by_reader = payments.get("fines_by_reader", Counter())
+
+        # Reader counters span every branch's loans and fines
+        issues_by_id = dict(lib.issues_by_id)
+        for branch in self.other_branches:
+            name = os.path.basename(os.path.normpath(branch.data_dir))
+            branch_issues = self.aggregate(f"{name}/issued_books", branch, "issued_books", aggregate_issues)
+            branch_payments = self.aggregate(f"{name}/payments", branch, "payments", aggregate_payments)
+            open_by_reader = open_by_reader + branch_issues.get("open_by_reader", Counter())
+            fines_by_reader = fines_by_reader + branch_payments.get("fines_by_reader", Counter())
+            issues_by_id.update(branch.issues_by_id)
+
+        problems = []
+        changed_books = []
+
+        # Stock: copies on the shelf are the copies owned (kept by add/update/transfer) minus copies on loan
+        for book in lib.books:
+            on_loan = open_by_book.get(str(book["id"]), 0)
+            if book["stock"] < 0:
+                problems.append({"type": "negative_stock", "key": book["id"], "expected": 0, "actual": book["stock"]})
+            if "total_copies" not in book:
+                continue
+            expected = book["total_copies"] - on_loan
+            if book["stock"] != expected:
+                problems.append({"type": "stock", "key": book["id"], "expected": expected, "actual": book["stock"]})
+                if repair:
+                    book["stock"] = expected
+                    changed_books.append(book)
+
+        # Loans that point at books which no longer exist
+        known_books = {str(book["id"]) for book in lib.books}
+        for book_id, count in open_by_book.items():
+            if book_id not in known_books:
+                problems.append({"type": "orphan_loans", "key": book_id, "expected": 0, "actual": count})
+
+        def check_readers():
+            changed_readers = []
+            for reader in [] if self.skip_readers else lib.readers:
+                changed = False
+                phone = reader["phone"]
+
+                expected_open = open_by_reader.get(phone, 0)
+                if reader.get("total_books_issued", 0) != expected_open:
+                    problems.append({"type": "reader_open_loans", "key": reader["reader_id"],
+                                     "expected": expected_open, "actual": reader.get("total_books_issued", 0)})
+                    if repair:
+                        reader["total_books_issued"] = expected_open
+                        changed = True
+
+                expected_fines = fines_by_reader.get(phone, 0)
+                if reader.get("total_fine_paid", 0) != expected_fines:
+                    problems.append({"type": "reader_fines", "key": reader["reader_id"],
+                                     "expected": expected_fines, "actual": reader.get("total_fine_paid", 0)})
+                    if repair:
+                        reader["total_fine_paid"] = expected_fines
+                        changed = True
+
+                # History entries must agree with the issue record they point at
+                for entry in reader.get("books_issued", []):
+                    issued = issues_by_id.get(entry.get("issue_id"))
+                    if issued and entry.get("status") != issued["status"]:
+                        problems.append({"type": "reader_history_status", "key": entry["issue_id"],
+                                         "expected": issued["status"], "actual": entry.get("status")})
+                        if repair:
+                            entry["status"] = issued["status"]
+                            if issued.get("actual_return_date"):
+                                entry["return_date"] = issued["actual_return_date"]
+                            changed = True
+
+                if changed:
+                    changed_readers.append(reader)
+            return changed_readers
+
+        # Repairs are applied under the reader file lock, to the readers as other branches last saved them
+        if repair and not self.skip_readers:
+            changed_readers = lib.save_readers(check_readers)
+        else:
+            lib.refresh_readers()
+            changed_readers = check_readers()
+
+        if repair:
+            if changed_books:
+                lib.save_books_to_json(lib.book_file, lib.books)
+                for book in changed_books:
+                    lib.reindex_book(book)
+                    lib.record_change("update", "book", book["id"], book)
+            if changed_readers:
+                for reader in changed_readers:
+                    lib.record_change("update", "reader", reader["reader_id"], reader)
+
+        LibraryManagement.save_books_to_json(self.state_file, self.state)
+        return problems
+
+
+"""Print a discrepancy report"""
+def print_report(problems, checker, repaired):
+    print("\n---- INTEGRITY CHECK ----")
+    print(f"Chunks recomputed: {checker.recomputed_chunks}, reused unchanged: {checker.reused_chunks}")
+    if checker.skip_readers:
+        print("Reader counters skipped: the reader file is shared by other branches (use --branch to check them).")
+    if not problems:
+        print("All counters match the ledgers.")
+        return
+    print(f"Found {len(problems)} discrepancy(ies){' - repaired' if repaired else ''}:")
+    print("-" * 80)
+    for problem in problems:
+        print(f"{problem['type']:<22} {str(problem['key']):<20} expected {problem['expected']}, found {problem['actual']}")
+    print("-" * 80)
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    repair = "--repair" in args
+    full = "--full" in args
+    branch = args[args.index("--branch") + 1] if "--branch" in args[:-1] else None
+    paths = [arg for arg in args if not arg.startswith("--") and arg != branch]
+
+    if branch:
+        # Multi-branch mode: check one branch, counting reader loans and fines in all of them
+        branches = MultiBranchLibrary(paths[0] if paths else "branches")
+        library = branches.open_branch(branch)
+        others = [branches.open_branch(name) for name in branches.branches() if name != branch]
+        checker = IntegrityChecker(library, full=full, other_branches=others)
+    else:
+        library = LibraryManagement(paths[0] if paths else ".")
+        checker = IntegrityChecker(library, full=full)
+    problems = checker.check(repair=repair)
+    print_report(problems, checker, repair)
+    sys.exit(1 if problems and not repair else 0)
@@ -0,0 +1,167 @@
+from concurrent.futures import ProcessPoolExecutor
+import json
+import os
+import re
+import sys
+
+import isbnlib
+
+from change_stream import ChangeStream
+
+
+"""Canonical ISBN-13 for a valid ISBN-10/13 (hyphens and spaces allowed), else None"""
+def canonical_isbn(value):
+    raw = isbnlib.canonical(str(value or ""))
+    if isbnlib.is_isbn13(raw):
+        return raw
+    if isbnlib.is_isbn10(raw):
+        return isbnlib.to_isbn13(raw)
+    return None
+
+
+"""Collapse whitespace and fix shouting/lowercase text; mixed case is left alone"""
+def normalize_text(value):
+    text = re.sub(r"\s+", " ", str(value or "")).strip()
+    if text and (text.islower() or text.isupper()):
+        text = re.sub(r"(?<!')\b[a-z]", lambda m: m.group(0).upper(), text.lower())
+    return text
+
+
+"""Validate and normalize one book; returns (normalized book, list of findings)"""
+def normalize_book(book):
+    normalized = dict(book)
+    findings = []
+
+    isbn = canonical_isbn(book.get("isbn"))
+    raw = re.sub(r"[\s-]", "", str(book.get("isbn") or ""))
+    if isbn:
+        if isbn != book.get("isbn"):
+            findings.append("isbn_canonicalized")
+        normalized["isbn"] = isbn
+    elif not raw:
+        findings.append("isbn_missing")
+    elif raw.isdigit() and len(raw) == 12 and raw[:3] in ["978", "979"]:
+        # Older generated ISBNs were stored without their check digit
+        normalized["isbn"] = raw + isbnlib.check_digit13(raw)
+        findings.append("isbn_check_digit_added")
+    else:
+        findings.append("isbn_invalid")
+
+    for field in ["title", "author"]:
+        value = normalize_text(book.get(field))
+        if value != book.get(field):
+            normalized[field] = value
+            findings.append(f"{field}_normalized")
+
+    language = normalize_text(book.get("language")).title()
+    if language != book.get("language"):
+        normalized["language"] = language
+        findings.append("language_normalized")
+
+    return normalized, findings
+
+
+"""Normalize one chunk of the catalog; runs inside a worker process"""
+def process_chunk(chunk):
+    return [normalize_book(book) for book in chunk]
+
+
+"""Key used to spot different editions of the same work"""
+def work_key(book):
+    title = re.sub(r"[^\w\s]", "", book.get("title", "").lower())
+    author = re.sub(r"[^\w\s]", "", book.get("author", "").lower())
+    return " ".join(title.split()), " ".join(author.split())
+
+
+"""Validate, normalize and de-duplicate a catalog; returns (normalized books, report)"""
+def run_pipeline(books, workers=None, chunk_size=1000):
+    chunks = [books[i:i + chunk_size] for i in range(0, len(books), chunk_size)]
+    if len(chunks) > 1 and workers != 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = [item for chunk_result in pool.map(process_chunk, chunks) for item in chunk_result]
+    else:
+        results = [item for chunk in chunks for item in process_chunk(chunk)]
+
+    normalized_books = [book for book, _ in results]
+    findings = {}
+    for book, book_findings in results:
+        for finding in book_findings:
+            findings.setdefault(finding, []).append(book["id"])
+
+    # ISBN -> book index; more than one book per ISBN is a duplicate record
+    isbn_index = {}
+    for book in normalized_books:
+        if canonical_isbn(book.get("isbn")):
+            isbn_index.setdefault(book["isbn"], []).append(book["id"])
+    duplicate_isbns = {isbn: ids for isbn, ids in isbn_index.items() if len(ids) > 1}
+
+    # Same title and author under different ISBNs are separate editions of one work
+    works = {}
+    for book in normalized_books:
+        works.setdefault(work_key(book), []).append(book)
+    editions = [{"title" : group[0]["title"], "author" : group[0]["author"],
+                 "books" : [{"id": book["id"], "isbn": book.get("isbn")} for book in group]}
+                for group in works.values() if len(group) > 1]
+
+    report = {
+        "books" : len(books),
+        "chunks" : len(chunks),
+        "findings" : {finding: {"count": len(ids), "book_ids": ids} for finding, ids in sorted(findings.items())},
+        "duplicate_isbns" : duplicate_isbns,
+        "duplicate_editions" : editions,
+        "isbn_index" : {isbn: ids[0] for isbn, ids in isbn_index.items()}
+    }
+    return normalized_books, report
+
+
+"""Command line entry point"""
+def main(args):
+    apply_changes = "--apply" in args
+    options = {"--workers" : None, "--chunk-size" : "1000", "--report" : "isbn_report.json"}
+    paths = []
+    i = 0
+    while i < len(args):
+        if args[i] in options and i + 1 < len(args):
+            options[args[i]] = args[i + 1]
+            i += 2
+            continue
+        if not args[i].startswith("--"):
+            paths.append(args[i])
+        i += 1
+    catalog_file = paths[0] if paths else "Books_Library.json"
+
+    if not os.path.exists(catalog_file):
+        print(f"Catalog file {catalog_file} not found")
+        return 1
+    with open(catalog_file, "r") as f:
+        books = json.load(f)
+
+    workers = int(options["--workers"]) if options["--workers"] else None
+    normalized_books, report = run_pipeline(books, workers, int(options["--chunk-size"]))
+
+    with open(options["--report"], "w") as f:
+        json.dump(report, f, indent=4)
+
+    print("\n---- ISBN VALIDATION REPORT ----")
+    print(f"Books checked: {report['books']} in {report['chunks']} chunk(s)")
+    for finding, details in report["findings"].items():
+        print(f"{finding}: {details['count']}")
+    print(f"Duplicate ISBNs: {len(report['duplicate_isbns'])}")
+    print(f"Works with several editions/records: {len(report['duplicate_editions'])}")
+    print(f"Full report written to {options['--report']}")
+
+    if apply_changes:
+        with open(catalog_file, "w") as f:
+            json.dump(normalized_books, f, indent=4)
+
+        # Rewritten books go to the catalog's change stream like any other book update
+        stream = ChangeStream(os.path.join(os.path.dirname(catalog_file) or ".", "changes"))
+        changed = [book for original, book in zip(books, normalized_books) if book != original]
+        for book in changed:
+            stream.append("update", "book", book["id"], book)
+        print(f"Normalized catalog written to {catalog_file} ({len(changed)} book(s) changed)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,222 @@
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import heapq
+import os
+import shutil
+import uuid
+
+from Library_Management import LibraryManagement
+from isbn_pipeline import canonical_isbn
+from library_indexes import normalize_tokens
+
+
+"""Score how well a book matches the search tokens (0 means no match)"""
+def relevance(book, tokens):
+    if not tokens:
+        return 0
+    query = " ".join(tokens)
+    title = " ".join(normalize_tokens(book.get("title", "")))
+    title_tokens = set(title.split())
+    author = " ".join(normalize_tokens(book.get("author", "")))
+
+    score = 0
+    if title == query:
+        score += 10
+    elif title.startswith(query):
+        score += 6
+    elif query in title:
+        score += 4
+    score += 2 * sum(1 for token in tokens if token in title_tokens)
+    if query in author:
+        score += 3
+    if query in book.get("genre", "").lower() or query in book.get("language", "").lower():
+        score += 1
+    return score
+
+
+"""Search one branch catalog; runs inside a worker process"""
+def search_branch(branch, book_file, term, limit):
+    tokens = normalize_tokens(term)
+    books = LibraryManagement.load_library_data(book_file, [])
+    results = []
+    for book in books:
+        score = relevance(book, tokens)
+        if score > 0:
+            results.append((score, book["stock"] > 0, book.get("rating", 0), branch, book))
+    return heapq.nlargest(limit, results, key=lambda r: r[:3])
+
+
+class MultiBranchLibrary:
+    """Per-branch catalog and circulation data with a shared reader registry"""
+
+    def __init__(self, root_dir="branches"):
+        self.root_dir = root_dir
+        self.reader_file = os.path.join(root_dir, "Lib_reader.json")
+        self.transfer_file = os.path.join(root_dir, "transfers.json")
+        os.makedirs(root_dir, exist_ok=True)
+
+    """List branch names (one sub-directory per branch)"""
+    def branches(self):
+        return sorted(name for name in os.listdir(self.root_dir)
+                      if os.path.isdir(os.path.join(self.root_dir, name)))
+
+    """Open a branch; the shared reader file is reloaded each time"""
+    def open_branch(self, branch):
+        return LibraryManagement(os.path.join(self.root_dir, branch), reader_file=self.reader_file)
+
+    """Create a branch, optionally seeded from an existing single-site data directory"""
+    def add_branch(self, branch, seed_dir=None):
+        branch_dir = os.path.join(self.root_dir, branch)
+        if os.path.exists(branch_dir):
+            print(f"Branch '{branch}' already exists")
+            return False
+        os.makedirs(branch_dir)
+
+        if seed_dir:
+            for filename in ["Books_Library.json", "issued_books.json", "payments.json", "memberships.json"]:
+                source = os.path.join(seed_dir, filename)
+                if os.path.exists(source):
+                    shutil.copy(source, os.path.join(branch_dir, filename))
+
+            # Merge the seed readers into the shared registry, keyed by phone
+            seed_readers = LibraryManagement.load_library_data(os.path.join(seed_dir, "Lib_reader.json"), [])
+            library = self.open_branch(branch)
+
+            def merge_seed_readers():
+                for reader in seed_readers:
+                    if reader["phone"] not in library.reader_index:
+                        library.readers.append(reader)
+                        library.reader_lookup.add(reader)
+
+            library.save_readers(merge_seed_readers)
+
+        print(f"Branch '{branch}' created")
+        return True
+
+    """Search every branch in parallel and merge the results by relevance"""
+    def search_all(self, term, limit=20):
+        branches = self.branches()
+        if not branches:
+            return []
+
+        with ProcessPoolExecutor(max_workers=min(len(branches), os.cpu_count() or 1)) as pool:
+            futures = [pool.submit(search_branch, branch, os.path.join(self.root_dir, branch, "Books_Library.json"),
+                                   term, limit)
+                       for branch in branches]
+            per_branch = [future.result() for future in futures]
+
+        # Each branch result is already sorted, so a k-way merge is enough
+        merged = heapq.merge(*per_branch, key=lambda r: r[:3], reverse=True)
+        return [(branch, book) for _, _, _, branch, book in list(merged)[:limit]]
+
+    """Move stock of a book, identified by ISBN (or its title in the source branch), between branches"""
+    def transfer_stock(self, key, from_branch, to_branch, quantity):
+        if from_branch == to_branch:
+            print("Source and destination branch must be different")
+            return False
+
+        source = self.open_branch(from_branch)
+        book = source.books_by_isbn.get(canonical_isbn(key)) or source.books_index.get(key.strip().lower())
+        if not book:
+            print(f"Book '{key}' not found in branch '{from_branch}'")
+            return False
+        # Branches number their books independently, so the ISBN is what identifies a book across them
+        isbn = canonical_isbn(book.get("isbn"))
+        if not isbn:
+            print(f"'{book['title']}' has no valid ISBN in '{from_branch}' - fix it before transferring")
+            return False
+        if quantity <= 0 or book["stock"] < quantity:
+            print(f"Cannot transfer {quantity} copies - '{from_branch}' has {book['stock']} in stock")
+            return False
+
+        destination = self.open_branch(to_branch)
+        target = destination.books_by_isbn.get(isbn)
+        op = "update"
+        if not target:
+            target = dict(book, id=max([b["id"] for b in destination.books], default=0) + 1, isbn=isbn,
+                          stock=0, total_copies=0)
+            destination.catalog_book(target)
+            op = "insert"
+        destination.adjust_stock(target, quantity)
+        source.adjust_stock(book, -quantity)
+        if source.save_books_to_json(source.book_file, source.books):
+            source.record_change("update", "book", book["id"], book)
+        if destination.save_books_to_json(destination.book_file, destination.books):
+            destination.record_change(op, "book", target["id"], target)
+
+        transfers = LibraryManagement.load_library_data(self.transfer_file, [])
+        known_ids = {transfer["transfer_id"] for transfer in transfers}
+        transfer_id = f"TRF-{str(uuid.uuid4())[:8]}"
+        while transfer_id in known_ids:
+            transfer_id = f"TRF-{str(uuid.uuid4())[:8]}"
+        transfers.append({
+            "transfer_id" : transfer_id,
+            "book_title" : book["title"],
+            "book_isbn" : isbn,
+            "from_branch" : from_branch,
+            "to_branch" : to_branch,
+            "quantity" : quantity,
+            "transfer_date" : datetime.now().strftime("%Y-%m-%d %H:%M")
+        })
+        LibraryManagement.save_books_to_json(self.transfer_file, transfers)
+
+        print(f"Transferred {quantity} copies of '{book['title']}' from {from_branch} to {to_branch}")
+        return True
+
+    """Pick a branch from a numbered list"""
+    def choose_branch(self, prompt):
+        branches = self.branches()
+        for i, branch in enumerate(branches, 1):
+            print(f"{i}. {branch}")
+        return branches[LibraryManagement.get_choice(prompt, 1, len(branches)) - 1]
+
+    """Main program loop for multi-branch mode"""
+    def run(self):
+        print("Welcome to Library Management System (multi-branch mode)!")
+
+        while True:
+            print("\n" + "=" * 50)
+            print("         BRANCH MANAGEMENT")
+            print("=" * 50)
+            print("1. Open Branch")
+            print("2. Search All Branches")
+            print("3. Transfer Stock")
+            print("4. Add Branch")
+            print("5. Exit")
+            print("=" * 50)
+            choice = LibraryManagement.get_choice("Enter your choice (1-5): ", 1, 5)
+
+            if choice in [1, 3] and not self.branches():
+                print("No branches yet. Please add a branch first.")
+                continue
+
+            if choice == 1:
+                self.open_branch(self.choose_branch("Select branch: ")).run()
+            elif choice == 2:
+                term = input("Enter title, author, genre or language: ").strip()
+                results = self.search_all(term)
+                if not results:
+                    print("No books found in any branch.")
+                    continue
+                print("-" * 80)
+                for branch, book in results:
+                    stock_status = f"In stock ({book["stock"]})" if book["stock"] > 0 else "Out of stock"
+                    print(f"[{branch}] {book["title"]} by {book["author"]} - {stock_status}")
+                print("-" * 80)
+            elif choice == 3:
+                key = input("Enter book ISBN (or exact title): ").strip()
+                from_branch = self.choose_branch("Transfer from branch: ")
+                to_branch = self.choose_branch("Transfer to branch: ")
+                quantity = LibraryManagement.get_choice("Enter quantity: ", 1, 10000)
+                self.transfer_stock(key, from_branch, to_branch, quantity)
+            elif choice == 4:
+                name = input("Enter branch name: ").strip()
+                seed_dir = input("Seed from existing data directory (optional): ").strip()
+                self.add_branch(name, seed_dir or None)
+            else:
+                print("Thank you for using Library Management System!")
+                break
+
+
+if __name__ == "__main__":
+    MultiBranchLibrary().run()
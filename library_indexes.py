@@ -0,0 +1,433 @@
+import bisect
+import heapq
+import itertools
+import re
+
+
+"""Normalize free text into lowercase word tokens"""
+def normalize_tokens(text):
+    return re.sub(r"[^\w\s]", " ", str(text).lower()).split()
+
+
+class TitleTrie:
+    """Prefix trie over book titles and authors for autocomplete"""
+
+    def __init__(self, books=(), limit=5):
+        self.limit = limit
+        self.root = {"children": {}, "ids": set(), "top": []}
+        self.books = {}
+        self.keys = {}
+        self.ranks = {}
+        for book in books:
+            self.add(book)
+
+    """Rank completions by rating, then in-stock first; only running out or restocking changes a book's rank"""
+    @staticmethod
+    def rank(book):
+        return (book.get("rating", 0), book.get("stock", 0) > 0, book["id"])
+
+    """Every word-aligned suffix of title and author, so 'hobbit' still finds 'The Hobbit'"""
+    @staticmethod
+    def index_keys(book):
+        keys = set()
+        for field in ("title", "author"):
+            tokens = normalize_tokens(book.get(field, ""))
+            for i in range(len(tokens)):
+                keys.add(" ".join(tokens[i:]))
+        return keys
+
+    """Walk the trie along key, optionally creating missing nodes"""
+    def path(self, key, create=False):
+        node = self.root
+        nodes = [node]
+        for char in key:
+            child = node["children"].get(char)
+            if child is None:
+                if not create:
+                    return None
+                child = {"children": {}, "ids": set(), "top": []}
+                node["children"][char] = child
+            node = child
+            nodes.append(node)
+        return nodes
+
+    """Add a book to the index, folding it into the bounded top-k of every node on its paths"""
+    def add(self, book):
+        book_id = book["id"]
+        if book_id in self.books:
+            self.remove(book_id)
+        keys = self.index_keys(book)
+        rank = self.rank(book)
+        self.books[book_id] = book
+        self.keys[book_id] = keys
+        self.ranks[book_id] = rank
+        seen = set()
+        for key in keys:
+            for node in self.path(key, create=True):
+                # Word suffixes share prefixes, so visit each node once
+                if id(node) in seen:
+                    continue
+                seen.add(id(node))
+                node["ids"].add(book_id)
+                top = node["top"]
+                if top is not None and (len(top) < self.limit or rank > top[-1][0]):
+                    top.append((rank, book_id))
+                    top.sort(reverse=True)
+                    del top[self.limit:]
+
+    """Remove a book from the index"""
+    def remove(self, book_id):
+        keys = self.keys.pop(book_id, set())
+        self.books.pop(book_id, None)
+        self.ranks.pop(book_id, None)
+        for key in keys:
+            nodes = self.path(key)
+            if not nodes:
+                continue
+            for node in nodes:
+                node["ids"].discard(book_id)
+                # Only a node that loses one of its top entries has to be refilled (lazily)
+                if node["top"] is not None and any(entry_id == book_id for _, entry_id in node["top"]):
+                    node["top"] = None
+            # Prune empty branches so the trie does not grow forever
+            for depth in range(len(key), 0, -1):
+                if nodes[depth]["ids"]:
+                    break
+                del nodes[depth - 1]["children"][key[depth - 1]]
+
+    """Re-index a book after its title, author, rating or availability changed; other stock changes are no-ops"""
+    def update(self, book):
+        book_id = book["id"]
+        if (book_id in self.books and self.ranks[book_id] == self.rank(book)
+                and self.keys[book_id] == self.index_keys(book)):
+            self.books[book_id] = book
+            return
+        self.add(book)
+
+    """Return the top ranked books whose title or author starts with prefix"""
+    def complete(self, prefix, limit=None):
+        limit = limit or self.limit
+        nodes = self.path(" ".join(normalize_tokens(prefix)))
+        if not nodes:
+            return []
+        node = nodes[-1]
+        if limit > self.limit:
+            return heapq.nlargest(limit, (self.books[i] for i in node["ids"]), key=self.rank)
+        # Each node keeps its top-k current on adds; only a removal from the top-k forces a refill
+        if node["top"] is None:
+            node["top"] = heapq.nlargest(self.limit, ((self.ranks[i], i) for i in node["ids"]))
+        return [self.books[book_id] for _, book_id in node["top"][:limit]]
+
+
+class SortedIndex:
+    """Bisect-backed sorted list of (key, row) entries with keyset paging"""
+
+    def __init__(self, entries=()):
+        self.entries = sorted(entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    """Insert an entry"""
+    def add(self, key, row):
+        bisect.insort(self.entries, (key, row))
+
+    """Remove an entry if present"""
+    def remove(self, key, row):
+        i = bisect.bisect_left(self.entries, (key, row))
+        if i < len(self.entries) and self.entries[i] == (key, row):
+            del self.entries[i]
+
+    """Return up to limit entries after the keyset cursor (the last entry of the previous page)"""
+    def page(self, cursor=None, limit=10, reverse=False):
+        if not reverse:
+            start = bisect.bisect_right(self.entries, cursor) if cursor else 0
+            return self.entries[start:start + limit]
+        end = bisect.bisect_left(self.entries, cursor) if cursor else len(self.entries)
+        return self.entries[max(end - limit, 0):end][::-1]
+
+    """Slice bounds of entries whose key lies in [low, high]; None means unbounded"""
+    def bounds(self, low=None, high=None):
+        start = bisect.bisect_left(self.entries, low, key=lambda entry: entry[0]) if low is not None else 0
+        end = bisect.bisect_right(self.entries, high, key=lambda entry: entry[0]) if high is not None \
+            else len(self.entries)
+        return start, max(start, end)
+
+    """Yield (key, row) entries with key in [low, high] in key order"""
+    def range(self, low=None, high=None, reverse=False):
+        start, end = self.bounds(low, high)
+        rows = range(end - 1, start - 1, -1) if reverse else range(start, end)
+        for i in rows:
+            yield self.entries[i]
+
+
+class RangeIndexes:
+    """Sorted range indexes over the numeric book fields"""
+
+    FIELDS = ["year", "rating", "price", "pages", "stock"]
+
+    def __init__(self, books=()):
+        self.indexes = {field: SortedIndex() for field in self.FIELDS}
+        self.books = {}
+        self.values = {}
+        for book in books:
+            self.add(book)
+
+    """Add a book to every range index"""
+    def add(self, book):
+        book_id = book["id"]
+        if book_id in self.books:
+            self.remove(book_id)
+        values = {field: book.get(field) or 0 for field in self.FIELDS}
+        self.books[book_id] = book
+        self.values[book_id] = values
+        for field, value in values.items():
+            self.indexes[field].add(value, book_id)
+
+    """Remove a book using the values it was indexed with"""
+    def remove(self, book_id):
+        values = self.values.pop(book_id, None)
+        if values is None:
+            return
+        self.books.pop(book_id, None)
+        for field, value in values.items():
+            self.indexes[field].remove(value, book_id)
+
+    """Re-index a book after price, stock or any other numeric field changed"""
+    def update(self, book):
+        self.add(book)
+
+    """Yield books with field in [low, high], ordered by that field"""
+    def range(self, field, low=None, high=None, reverse=False):
+        for _, book_id in self.indexes[field].range(low, high, reverse):
+            yield self.books[book_id]
+
+    """Books matching every {field: (low, high)} range, ordered by the most selective field"""
+    def query(self, ranges):
+        ranges = {field: bounds for field, bounds in ranges.items() if bounds}
+        if not ranges:
+            return iter(self.books.values())
+
+        # Drive from the narrowest range and check the others per candidate
+        def width(field):
+            start, end = self.indexes[field].bounds(*ranges[field])
+            return end - start
+
+        driver = min(ranges, key=width)
+        others = [(field, low, high) for field, (low, high) in ranges.items() if field != driver]
+        return (book for book in self.range(driver, *ranges[driver])
+                if all((low is None or self.values[book["id"]][field] >= low) and
+                       (high is None or self.values[book["id"]][field] <= high)
+                       for field, low, high in others))
+
+
+"""Yield the row numbers set in an integer bitmap"""
+def iter_bits(bitmap):
+    while bitmap:
+        low = bitmap & -bitmap
+        yield low.bit_length() - 1
+        bitmap ^= low
+
+
+class FacetIndex:
+    """Bitmap posting lists per facet value, kept current on every book change"""
+
+    # Categorical facets keyed on the lowercase value
+    FIELDS = ["genre", "language", "author"]
+    # Numeric facets are counted in fixed-width buckets
+    BUCKETS = {"year": 10, "rating": 1, "price": 500}
+
+    def __init__(self, books=()):
+        self.all = 0
+        self.books = {}
+        self.values = {}
+        self.labels = {}
+        self.postings = {facet: {} for facet in self.FIELDS + list(self.BUCKETS) + ["in_stock"]}
+        for book in books:
+            self.add(book)
+
+    """Bucket label for a numeric value, e.g. year 1954 -> 1950"""
+    def bucket(self, facet, value):
+        width = self.BUCKETS[facet]
+        return int(value // width * width)
+
+    """Facet values of a book"""
+    def facet_values(self, book):
+        values = {field: str(book.get(field, "")).strip().lower() for field in self.FIELDS}
+        for facet in self.BUCKETS:
+            values[facet] = self.bucket(facet, book.get(facet, 0) or 0)
+        values["in_stock"] = book.get("stock", 0) > 0
+        return values
+
+    """Add a book to the index"""
+    def add(self, book):
+        book_id = book["id"]
+        if book_id in self.books:
+            self.remove(book_id)
+        bit = 1 << book_id
+        values = self.facet_values(book)
+        self.books[book_id] = book
+        self.values[book_id] = values
+        self.all |= bit
+        for facet, value in values.items():
+            postings = self.postings[facet]
+            postings[value] = postings.get(value, 0) | bit
+            if facet in self.FIELDS:
+                self.labels.setdefault((facet, value), str(book.get(facet, "")).strip())
+
+    """Remove a book from the index"""
+    def remove(self, book_id):
+        values = self.values.pop(book_id, None)
+        if values is None:
+            return
+        self.books.pop(book_id, None)
+        bit = 1 << book_id
+        self.all &= ~bit
+        for facet, value in values.items():
+            postings = self.postings[facet]
+            postings[value] &= ~bit
+            if not postings[value]:
+                del postings[value]
+                self.labels.pop((facet, value), None)
+
+    """Re-index a book after any field or its stock changed"""
+    def update(self, book):
+        self.add(book)
+
+    """Bitmap of books matching a numeric range, using whole buckets where possible"""
+    def range_bitmap(self, facet, low=None, high=None):
+        bitmap = 0
+        width = self.BUCKETS[facet]
+        for bucket, posting in self.postings[facet].items():
+            if (low is not None and bucket + width <= low) or (high is not None and bucket > high):
+                continue
+            # Buckets are half-open [bucket, bucket + width), which also holds for float values like ratings
+            if (low is None or bucket >= low) and (high is None or bucket + width <= high):
+                bitmap |= posting
+                continue
+            # Bucket straddles a boundary, so check its books individually
+            for book_id in iter_bits(posting):
+                value = self.books[book_id].get(facet, 0) or 0
+                if (low is None or value >= low) and (high is None or value <= high):
+                    bitmap |= 1 << book_id
+        return bitmap
+
+    """Filter books and return (lazy matching books, match count, per-facet counts)"""
+    def search(self, filters):
+        # filters: genre/language/author values, (low, high) for year/rating/price, in_stock=True
+        selected = self.all
+        for facet, value in filters.items():
+            if value is None or value == "":
+                continue
+            if facet in self.FIELDS:
+                selected &= self.postings[facet].get(str(value).strip().lower(), 0)
+            elif facet in self.BUCKETS:
+                selected &= self.range_bitmap(facet, *value)
+            elif facet == "in_stock" and value:
+                selected &= self.postings["in_stock"].get(True, 0)
+
+        counts = {}
+        for facet, postings in self.postings.items():
+            facet_counts = {}
+            for value, posting in postings.items():
+                count = (posting & selected).bit_count()
+                if count:
+                    facet_counts[self.labels.get((facet, value), value)] = count
+            counts[facet] = dict(sorted(facet_counts.items(), key=lambda item: -item[1]))
+
+        return (self.books[book_id] for book_id in iter_bits(selected)), selected.bit_count(), counts
+
+
+class ReaderIndex:
+    """Reader lookups by phone, reader_id and email, plus prefix search on name"""
+
+    def __init__(self, readers=()):
+        self.by_phone = {}
+        self.by_id = {}
+        self.by_email = {}
+        self.names = SortedIndex()
+        self.name_keys = {}
+        for reader in readers:
+            self.add(reader)
+
+    """Normalized email key, or None for blank/placeholder emails"""
+    @staticmethod
+    def email_key(email):
+        email = str(email or "").strip().lower()
+        return email if email and email != "n/a" else None
+
+    """Word-aligned suffixes of the name so a surname prefix also matches"""
+    @staticmethod
+    def name_keys_for(name):
+        tokens = normalize_tokens(name)
+        return {" ".join(tokens[i:]) for i in range(len(tokens))}
+
+    """Add or refresh a reader in every index"""
+    def add(self, reader):
+        phone = reader["phone"]
+        if phone in self.by_phone:
+            self.remove(phone)
+        self.by_phone[phone] = reader
+        if reader.get("reader_id"):
+            self.by_id[reader["reader_id"].upper()] = reader
+        email = self.email_key(reader.get("email"))
+        if email:
+            self.by_email.setdefault(email, reader)
+        keys = self.name_keys_for(reader.get("name", ""))
+        self.name_keys[phone] = keys
+        for key in keys:
+            self.names.add(key, phone)
+
+    """Remove a reader from every index"""
+    def remove(self, phone):
+        reader = self.by_phone.pop(phone, None)
+        if reader is None:
+            return
+        if self.by_id.get(str(reader.get("reader_id", "")).upper()) is reader:
+            del self.by_id[reader["reader_id"].upper()]
+        email = self.email_key(reader.get("email"))
+        if email and self.by_email.get(email) is reader:
+            del self.by_email[email]
+        for key in self.name_keys.pop(phone, set()):
+            self.names.remove(key, phone)
+
+    """Lazily yield each reader whose name (or any later word of it) starts with prefix, once"""
+    def iter_name(self, prefix):
+        prefix = " ".join(normalize_tokens(prefix))
+        if not prefix:
+            return
+        seen = set()
+        for _, phone in self.names.range(prefix, prefix + "\uffff"):
+            if phone not in seen:
+                seen.add(phone)
+                yield self.by_phone[phone]
+
+    """Upper bound on the readers matching a name prefix, without visiting them"""
+    def count_name(self, prefix):
+        prefix = " ".join(normalize_tokens(prefix))
+        if not prefix:
+            return 0
+        start, end = self.names.bounds(prefix, prefix + "\uffff")
+        return end - start
+
+    """Readers whose name (or any later word of it) starts with prefix"""
+    def search_name(self, prefix, limit=10):
+        return list(itertools.islice(self.iter_name(prefix), limit))
+
+    """Resolve a unique key (phone, reader_id or email) to its reader, or None"""
+    def find_exact(self, key):
+        key = key.strip()
+        if key in self.by_phone:
+            return self.by_phone[key]
+        if key.upper() in self.by_id:
+            return self.by_id[key.upper()]
+        return self.by_email.get(self.email_key(key))
+
+    """Resolve a phone, reader_id, email or name prefix to matching readers"""
+    def find(self, key):
+        reader = self.find_exact(key)
+        if reader:
+            return [reader]
+        if key.strip().isdigit():
+            return []
+        return self.search_name(key)
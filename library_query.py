@@ -0,0 +1,379 @@
+import heapq
+import itertools
+import math
+import operator
+import sys
+
+from library_indexes import iter_bits
+
+
+OPERATORS = {
+    "==" : operator.eq,
+    "!=" : operator.ne,
+    "<" : operator.lt,
+    "<=" : operator.le,
+    ">" : operator.gt,
+    ">=" : operator.ge,
+    "in" : lambda value, options: value in options,
+    "contains" : lambda value, term: str(term).lower() in str(value).lower(),
+    "startswith" : lambda value, prefix: str(value).lower().startswith(str(prefix).lower())
+}
+
+AGGREGATES = {
+    "count" : len,
+    "sum" : sum,
+    "min" : min,
+    "max" : max,
+    "avg" : lambda values: sum(values) / len(values) if values else 0
+}
+
+COLLECTIONS = ["books", "readers", "issued_books", "payments", "memberships"]
+
+
+"""Check a row against (field, op, value) predicates; incomparable values never match"""
+def matches(row, predicates):
+    try:
+        return all(OPERATORS[op](row.get(field), value) for field, op, value in predicates)
+    except TypeError:
+        return False
+
+
+class AccessPath:
+    """One way of producing the base rows of a query"""
+
+    def __init__(self, description, estimate, rows, served=(), order=None):
+        self.description = description
+        self.estimate = estimate
+        self.rows = rows  # callable returning an iterator
+        self.served = list(served)  # predicates answered exactly by the index (values may be unhashable)
+        self.order = order  # (field, reverse) when rows come out sorted
+
+
+class Query:
+    """Composable query over the library collections with a small cost-based planner"""
+
+    def __init__(self, library, collection):
+        if collection not in COLLECTIONS:
+            raise ValueError(f"Unknown collection '{collection}'. Choose from: {', '.join(COLLECTIONS)}")
+        self.library = library
+        self.collection = collection
+        self.predicates = []
+        self.joins = []
+        self.fields = None
+        self.groups = None
+        self.aggregates = {}
+        self.order = None
+        self.max_rows = None
+
+    """Add a filter, e.g. where("price", "<=", 500)"""
+    def where(self, field, op, value):
+        if op not in OPERATORS:
+            raise ValueError(f"Unknown operator '{op}'")
+        self.predicates.append((field, op, value))
+        return self
+
+    """Inner join another collection; its fields are prefixed with the alias"""
+    def join(self, collection, left_field, right_field, alias=None):
+        if collection not in COLLECTIONS:
+            raise ValueError(f"Unknown collection '{collection}'")
+        self.joins.append((collection, left_field, right_field, alias or collection))
+        return self
+
+    """Keep only the given fields"""
+    def select(self, *fields):
+        self.fields = list(fields)
+        return self
+
+    """Group rows, e.g. group_by("genre", books=("count", "id"), stock=("sum", "stock"))"""
+    def group_by(self, *fields, **aggregates):
+        for name, (func, _) in aggregates.items():
+            if func not in AGGREGATES:
+                raise ValueError(f"Unknown aggregate '{func}' for '{name}'")
+        self.groups = list(fields)
+        self.aggregates = aggregates
+        return self
+
+    """Sort the result"""
+    def order_by(self, field, desc=False):
+        self.order = (field, desc)
+        return self
+
+    """Stop after n rows"""
+    def limit(self, n):
+        self.max_rows = n
+        return self
+
+    """Predicates on the base collection can be pushed down to an access path"""
+    def base_predicates(self):
+        aliases = tuple(f"{alias}." for _, _, _, alias in self.joins)
+        return [p for p in self.predicates if not p[0].startswith(aliases)]
+
+    """Candidate access paths for the base collection"""
+    def access_paths(self):
+        lib = self.library
+        rows = getattr(lib, self.collection)
+        predicates = self.base_predicates()
+        paths = [AccessPath(f"Scan {self.collection}", len(rows), lambda: iter(rows))]
+
+        # Indexes on normalized keys (lowercase titles, facets, upper-case IDs) only narrow the
+        # candidates; the case-sensitive == predicate stays in the residual filter
+        def lookup(index, key, label, predicate, exact=True):
+            found = index.get(key)
+            return AccessPath(f"IndexLookup {label} = {predicate[2]!r}", 1 if found else 0,
+                              lambda: iter([found] if found else []), [predicate] if exact else [])
+
+        eq = {field: p for p in predicates for field in [p[0]] if p[1] == "=="}
+
+        if self.collection == "books":
+            if "id" in eq:
+                paths.append(lookup(lib.books_by_id, eq["id"][2], "books.id", eq["id"]))
+            if "title" in eq:
+                paths.append(lookup(lib.books_index, str(eq["title"][2]).lower(), "books.title", eq["title"], False))
+            for field in lib.facet_index.FIELDS:
+                if field in eq:
+                    bitmap = lib.facet_index.postings[field].get(str(eq[field][2]).strip().lower(), 0)
+                    paths.append(AccessPath(f"BitmapIndex books.{field} = {eq[field][2]!r}", bitmap.bit_count(),
+                                            lambda bitmap=bitmap: (lib.facet_index.books[i] for i in iter_bits(bitmap))))
+            for field in lib.range_indexes.FIELDS:
+                field_preds = [p for p in predicates if p[0] == field and p[1] in ["==", "<", "<=", ">", ">="]]
+                low = max([p[2] for p in field_preds if p[1] in ["==", ">", ">="]], default=None)
+                high = min([p[2] for p in field_preds if p[1] in ["==", "<", "<="]], default=None)
+                if field_preds:
+                    start, end = lib.range_indexes.indexes[field].bounds(low, high)
+                    served = [p for p in field_preds if p[1] in ["==", "<=", ">="]]
+                    paths.append(AccessPath(f"IndexRange books.{field} [{low}, {high}]", end - start,
+                                            lambda field=field, low=low, high=high:
+                                                lib.range_indexes.range(field, low, high),
+                                            served, (field, False)))
+                if self.order and self.order[0] == field:
+                    # Walking the index in order lets a limit stop the scan early
+                    desc = self.order[1]
+                    paths.append(AccessPath(f"IndexScan books.{field} {'DESC' if desc else 'ASC'}", len(rows),
+                                            lambda field=field, desc=desc:
+                                                lib.range_indexes.range(field, reverse=desc),
+                                            [], (field, desc)))
+
+        elif self.collection == "readers":
+            for field, index in [("phone", lib.reader_lookup.by_phone), ("reader_id", lib.reader_lookup.by_id)]:
+                if field in eq:
+                    key = str(eq[field][2]).upper() if field == "reader_id" else eq[field][2]
+                    paths.append(lookup(index, key, f"readers.{field}", eq[field], field == "phone"))
+            if "email" in eq:
+                key = lib.reader_lookup.email_key(eq["email"][2])
+                paths.append(lookup(lib.reader_lookup.by_email, key, "readers.email", eq["email"], False))
+            for p in predicates:
+                if p[0] == "name" and p[1] == "startswith":
+                    paths.append(AccessPath(f"IndexPrefix readers.name '{p[2]}*'", lib.reader_lookup.count_name(p[2]),
+                                            lambda prefix=p[2]: lib.reader_lookup.iter_name(prefix)))
+
+        elif self.collection == "issued_books":
+            if "issue_id" in eq:
+                paths.append(lookup(lib.issues_by_id, eq["issue_id"][2], "issued_books.issue_id", eq["issue_id"]))
+            status = eq.get("status")
+            if status and status[2] == "issued":
+                for field, index in [("reader_phone", lib.open_issues_by_reader), ("book_id", lib.open_issues_by_book)]:
+                    if field in eq:
+                        loans = index.get(eq[field][2], {})
+                        paths.append(AccessPath(f"IndexLookup open loans by {field} = {eq[field][2]!r}", len(loans),
+                                                lambda loans=loans: iter(list(loans.values())),
+                                                [status, eq[field]]))
+                desc = bool(self.order and self.order[0] == "return_date" and self.order[1])
+                paths.append(AccessPath(f"IndexScan open loans by return_date {'DESC' if desc else 'ASC'}",
+                                        len(lib.due_index),
+                                        lambda desc=desc: (lib.issues_by_id[issue_id] for _, issue_id in
+                                                           (reversed(lib.due_index.entries) if desc
+                                                            else iter(lib.due_index.entries))),
+                                        [status], ("return_date", desc)))
+
+        return paths
+
+    """Estimated cost of producing the final rows through a path"""
+    def cost(self, path):
+        residual = len([p for p in self.base_predicates() if p not in path.served])
+        sorted_already = not self.order or path.order == tuple(self.order)
+        if sorted_already and self.max_rows is not None and not self.groups and not self.joins:
+            # Limit is pushed into the stream; assume each residual filter halves the output
+            return min(path.estimate, self.max_rows * (2 ** residual))
+        if sorted_already:
+            return path.estimate
+        rows = max(path.estimate, 1)
+        return rows + rows * math.log2(rows + 1)
+
+    """Pick the cheapest access path"""
+    def plan(self):
+        return min(self.access_paths(), key=self.cost)
+
+    """Right-hand index usable for a join on right_field, if any"""
+    def join_index(self, collection, right_field):
+        lib = self.library
+        indexes = {
+            ("books", "id") : lib.books_by_id,
+            ("readers", "phone") : lib.reader_lookup.by_phone,
+            ("readers", "reader_id") : lib.reader_lookup.by_id,
+            ("issued_books", "issue_id") : lib.issues_by_id
+        }
+        return indexes.get((collection, right_field))
+
+    """Execute the query and return a list of result rows"""
+    def run(self):
+        path = self.plan()
+        base = self.base_predicates()
+        residual = [p for p in base if p not in path.served]
+        rows = (row for row in path.rows() if matches(row, residual))
+
+        for collection, left_field, right_field, alias in self.joins:
+            rows = self.join_rows(rows, collection, left_field, right_field, alias)
+
+        late = [p for p in self.predicates if p not in base]
+        if late:
+            rows = (row for row in rows if matches(row, late))
+
+        if self.groups is not None:
+            rows = self.group_rows(rows)
+
+        rows = self.order_rows(rows, path)
+        if self.max_rows is not None:
+            rows = itertools.islice(rows, self.max_rows)
+
+        if self.fields:
+            return [{field: row.get(field) for field in self.fields} for row in rows]
+        return [dict(row) for row in rows]
+
+    """Hash or index nested-loop join"""
+    def join_rows(self, rows, collection, left_field, right_field, alias):
+        index = self.join_index(collection, right_field)
+        # The reader_id index is keyed on the upper-cased ID
+        normalize = index is not None and collection == "readers" and right_field == "reader_id"
+        if index is None:
+            index = {}
+            for right in getattr(self.library, collection):
+                index.setdefault(right.get(right_field), []).append(right)
+
+        for row in rows:
+            key = row.get(left_field)
+            if normalize and key is not None:
+                key = str(key).upper()
+            found = index.get(key)
+            if found is None:
+                continue
+            for right in found if isinstance(found, list) else [found]:
+                merged = dict(row)
+                merged.update({f"{alias}.{field}": value for field, value in right.items()})
+                yield merged
+
+    """Aggregate rows per group"""
+    def group_rows(self, rows):
+        groups = {}
+        for row in rows:
+            key = tuple(row.get(field) for field in self.groups)
+            groups.setdefault(key, []).append(row)
+
+        for key, members in groups.items():
+            result = dict(zip(self.groups, key))
+            for name, (func, field) in self.aggregates.items():
+                values = members if func == "count" else [m.get(field) for m in members if m.get(field) is not None]
+                result[name] = AGGREGATES[func](values)
+            yield result
+
+    """Sort unless the access path already delivers rows in the requested order"""
+    def order_rows(self, rows, path):
+        if not self.order:
+            return rows
+        field, desc = self.order
+        if path.order == (field, desc) and self.groups is None:
+            return rows
+
+        def sort_key(row):
+            value = row.get(field)
+            return (value is None, value) if not desc else (value is not None, value)
+
+        if self.max_rows is not None:
+            # Top-k keeps only limit rows in memory
+            pick = heapq.nlargest if desc else heapq.nsmallest
+            return iter(pick(self.max_rows, rows, key=sort_key))
+        return iter(sorted(rows, key=sort_key, reverse=desc))
+
+    """Describe the chosen plan, e.g. to see whether a query scans or uses an index"""
+    def explain(self):
+        path = self.plan()
+        base = self.base_predicates()
+        residual = [p for p in base if p not in path.served]
+        lines = []
+
+        if self.max_rows is not None:
+            lines.append(f"Limit {self.max_rows}")
+        if self.fields:
+            lines.append(f"Project [{', '.join(self.fields)}]")
+        if self.order:
+            field, desc = self.order
+            if path.order == (field, desc) and self.groups is None:
+                lines.append(f"Order by {field} {'DESC' if desc else 'ASC'} (from index, no sort)")
+            elif self.max_rows is not None:
+                lines.append(f"TopK sort by {field} {'DESC' if desc else 'ASC'}")
+            else:
+                lines.append(f"Sort by {field} {'DESC' if desc else 'ASC'}")
+        if self.groups is not None:
+            lines.append(f"GroupBy [{', '.join(self.groups)}] -> {', '.join(self.aggregates)}")
+        late = [p for p in self.predicates if p not in base]
+        if late:
+            lines.append("Filter " + " AND ".join(f"{f} {op} {v!r}" for f, op, v in late))
+        for collection, left_field, right_field, alias in reversed(self.joins):
+            kind = "IndexJoin" if self.join_index(collection, right_field) is not None else "HashJoin"
+            lines.append(f"{kind} {alias} ON {left_field} = {collection}.{right_field}")
+        if residual:
+            lines.append("Filter " + " AND ".join(f"{f} {op} {v!r}" for f, op, v in residual))
+        lines.append(f"{path.description} (est. {path.estimate} rows, cost {self.cost(path):.0f})")
+
+        return "\n".join("  " * depth + line for depth, line in enumerate(lines))
+
+
+"""Sample queries covering every operator; each must return the same rows as a plain scan"""
+SELF_CHECK_QUERIES = [
+    ("books", [("genre", "in", ["Fantasy", "Fiction"])], ("price", False), None),
+    ("books", [("genre", "==", "Fiction")], ("price", False), 3),
+    ("books", [("genre", "==", "fiction")], ("price", False), 3),
+    ("books", [("title", "==", "The Hobbit")], None, None),
+    ("books", [("rating", ">=", 3), ("rating", "<=", 4)], ("rating", True), None),
+    ("books", [("year", "<", 1950), ("language", "!=", "English")], None, None),
+    ("books", [("author", "contains", "king")], ("year", False), 5),
+    ("readers", [("name", "startswith", "ra")], None, None),
+    ("issued_books", [("status", "==", "issued")], ("return_date", True), 5),
+    ("payments", [("payment_method", "in", ["Cash", "UPI"])], ("amount", True), 5)
+]
+
+
+"""Run the sample queries through the planner and compare against a full scan; returns the mismatches"""
+def self_check(library):
+    failures = []
+    for collection, predicates, order, limit in SELF_CHECK_QUERIES:
+        query = Query(library, collection)
+        for predicate in predicates:
+            query.where(*predicate)
+        if order:
+            query.order_by(*order)
+        expected = [row for row in getattr(library, collection) if matches(row, predicates)]
+        got = query.run()
+        ok = sorted(map(repr, got)) == sorted(map(repr, expected))
+        if order:
+            # Ties may come back in any order, so only the sequence of sort keys has to agree
+            keys = sorted((row.get(order[0]) for row in expected), reverse=order[1])
+            ok = ok and [row.get(order[0]) for row in got] == keys
+        if limit is not None:
+            query.limit(limit)
+            got = query.run()
+            ok = ok and len(got) == min(len(expected), limit) and all(row in expected for row in got)
+            if order:
+                ok = ok and [row.get(order[0]) for row in got] == keys[:limit]
+        if not ok:
+            failures.append((collection, predicates, query.explain()))
+    return failures
+
+
+if __name__ == "__main__":
+    from Library_Management import LibraryManagement
+
+    failures = self_check(LibraryManagement(sys.argv[1] if len(sys.argv) > 1 else "."))
+    for collection, predicates, plan in failures:
+        print(f"Mismatch on {collection} {predicates}:\n{plan}")
+    print(f"{len(SELF_CHECK_QUERIES) - len(failures)}/{len(SELF_CHECK_QUERIES)} sample queries match a full scan")
+    sys.exit(1 if failures else 0)
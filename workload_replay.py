@@ -0,0 +1,410 @@
+from concurrent.futures import ProcessPoolExecutor
+import builtins
+import contextlib
+import glob
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import shutil
+import sys
+import tempfile
+import time
+
+from Library_Management import LibraryManagement
+from library_indexes import normalize_tokens
+
+
+OPERATIONS = {
+    1 : "search_books",
+    2 : "issued_book",
+    3 : "add_new_books",
+    4 : "update_books",
+    5 : "delete_book",
+    6 : "return_book",
+    7 : "view_readers_profile",
+    8 : "view_issued_books",
+    9 : "purchase_book",
+    10 : "purchase_membership",
+    11 : "view_payment_history",
+    12 : "stock_report",
+    13 : "exit"
+}
+
+# Payment details are replaced by fixed test values; the app only validates them, so replays are unaffected
+SYNTHETIC_ANSWERS = {
+    "card number" : "4111111111111111",
+    "CVV" : "123",
+    "expiry date" : "12/30",
+    "UPI ID" : "reader@upi"
+}
+
+# Reader identity is pseudonymized with a keyed hash; replay applies the same mapping to its data copy.
+# The combined lookup prompt comes first because it also mentions "phone number"
+IDENTITY_PROMPTS = [
+    ("reader ID, email or name", "lookup"),
+    ("phone number", "phone"),
+    ("your name", "name"),
+    ("email", "email"),
+    ("address", "address")
+]
+
+
+"""Stable pseudonym for a phone, email, name or address; the secret stays out of the trace"""
+def pseudonym(secret, kind, value):
+    value = value.strip().lower() if kind == "email" else value.strip()
+    if not value:
+        return value
+    if kind == "name":
+        # Word by word, so a lookup by first name or surname still finds the pseudonymized reader
+        return " ".join("n" + hmac.new(secret.encode(), f"name:{word}".encode(), hashlib.sha256).hexdigest()[:8]
+                        for word in normalize_tokens(value))
+    digest = hmac.new(secret.encode(), f"{kind}:{value}".encode(), hashlib.sha256).hexdigest()
+    if kind == "phone":
+        return "9" + str(int(digest, 16) % 10 ** 9).zfill(9)
+    if kind == "email":
+        return f"user{digest[:10]}@example.com"
+    return f"{kind.title()} {digest[:8]}"
+
+
+"""Complete the last, possibly partial, word of a name lookup when every matching reader agrees on it"""
+def complete_name_key(readers, key):
+    tokens = normalize_tokens(key)
+    if not tokens:
+        return key
+    completions = set()
+    for reader in readers.iter_name(key):
+        completions.update(word for word in normalize_tokens(reader.get("name", "")) if word.startswith(tokens[-1]))
+        if len(completions) > 1:
+            return key
+    return " ".join(tokens[:-1] + list(completions)) if completions else key
+
+
+"""Redact one recorded answer based on the prompt it answered"""
+def redact_answer(secret, prompt, answer, readers=None):
+    for marker, synthetic in SYNTHETIC_ANSWERS.items():
+        if marker in prompt:
+            return synthetic if answer.strip() else answer
+    for marker, kind in IDENTITY_PROMPTS:
+        if marker not in prompt:
+            continue
+        if kind == "lookup":
+            # The reader lookup accepts several kinds of key; reader IDs are kept as they are
+            key = answer.strip()
+            if key.isdigit() and len(key) == 10:
+                kind = "phone"
+            elif "@" in key:
+                kind = "email"
+            elif key.upper().startswith("READ"):
+                return answer
+            else:
+                kind = "name"
+                # Word-wise pseudonyms only match whole words, so "Kap" is recorded as "kapil"
+                if readers is not None:
+                    answer = complete_name_key(readers, key)
+        return pseudonym(secret, kind, answer)
+    return answer
+
+
+"""Apply the recording's pseudonyms to the reader data in a replay copy"""
+def pseudonymize_data(work_dir, secret):
+    fields = {
+        "Lib_reader.json" : {"phone": "phone", "name": "name", "email": "email", "address": "address"},
+        "issued_books.json" : {"reader_phone": "phone", "reader_name": "name"},
+        "payments.json" : {"reader_phone": "phone"},
+        "memberships.json" : {"reader_phone": "phone", "reader_name": "name"}
+    }
+    for filename, mapping in fields.items():
+        path = os.path.join(work_dir, filename)
+        records = LibraryManagement.load_library_data(path, [])
+        for record in records:
+            for field, kind in mapping.items():
+                value = record.get(field)
+                # Placeholder emails are left alone, as the app ignores them for lookups
+                if isinstance(value, str) and value.strip().lower() not in ["", "n/a"]:
+                    record[field] = pseudonym(secret, kind, value)
+        if records:
+            LibraryManagement.save_books_to_json(path, records)
+
+
+"""Load the pseudonym secret of a recording, creating it on first use"""
+def load_secret(key_file, create=False):
+    if os.path.exists(key_file):
+        with open(key_file, "r") as f:
+            return f.read().strip()
+    if not create:
+        return None
+    secret = secrets.token_hex(16)
+    with open(key_file, "w") as f:
+        f.write(secret)
+    return secret
+
+
+class WorkloadRecorder:
+    """Records every menu operation of LibraryManagement.run() with its (redacted) inputs and timing"""
+
+    def __init__(self, trace_file, key_file=None, library=None):
+        self.trace_file = trace_file
+        self.library = library
+        # Keep the key file private; the trace alone does not reveal card details or reader identities
+        self.key_file = key_file or trace_file + ".key"
+        self.secret = None
+        self.inputs = []
+        self.choice = None
+        self.started = None
+        self.trace_start = None
+        self.real_input = None
+        self.file = None
+
+    def __enter__(self):
+        self.secret = load_secret(self.key_file, create=True)
+        self.file = open(self.trace_file, "a")
+        self.trace_start = time.perf_counter()
+        # Every prompt in the app goes through input(), so capture answers there
+        self.real_input = builtins.input
+        builtins.input = self.input
+        return self
+
+    def __exit__(self, *exc):
+        builtins.input = self.real_input
+        self.file.close()
+        return False
+
+    """Pass-through input() that remembers the answer, redacted"""
+    def input(self, prompt=""):
+        answer = self.real_input(prompt)
+        readers = self.library.reader_lookup if self.library else None
+        self.inputs.append(redact_answer(self.secret, prompt, answer, readers))
+        return answer
+
+    """Start timing an operation; the menu answer itself is not part of its inputs"""
+    def begin(self, choice):
+        self.choice = choice
+        self.inputs = []
+        self.started = time.perf_counter()
+
+    """Write the finished operation to the trace"""
+    def end(self):
+        finished = time.perf_counter()
+        self.file.write(json.dumps({
+            "offset" : round(self.started - self.trace_start, 6),
+            "choice" : self.choice,
+            "op" : OPERATIONS.get(self.choice, "unknown"),
+            "inputs" : self.inputs,
+            "duration_ms" : round((finished - self.started) * 1000, 3)
+        }) + "\n")
+        self.file.flush()
+
+
+"""Load a recorded trace"""
+def load_trace(trace_file):
+    with open(trace_file, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+"""Latency percentile (nearest rank) in milliseconds"""
+def percentile(values, pct):
+    if not values:
+        return 0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))]
+
+
+class CountingFile:
+    """File object wrapper that adds what is read and written through it to the replay's I/O counters"""
+
+    def __init__(self, file, io_stats):
+        self.file = file
+        self.io_stats = io_stats
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return self.file.__exit__(*exc)
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+    def __iter__(self):
+        for line in self.file:
+            self.count("bytes_read", line)
+            yield line
+
+    """Add the size of data, in bytes, to one counter"""
+    def count(self, counter, data):
+        self.io_stats[counter] += len(data.encode() if isinstance(data, str) else data)
+
+    def read(self, *args):
+        data = self.file.read(*args)
+        self.count("bytes_read", data)
+        return data
+
+    def readline(self, *args):
+        line = self.file.readline(*args)
+        self.count("bytes_read", line)
+        return line
+
+    def write(self, data):
+        self.count("bytes_written", data)
+        return self.file.write(data)
+
+
+"""Replay a trace against a private copy of the data files; runs inside a worker process"""
+def replay_worker(worker_id, trace, data_dir, speed, secret=None):
+    work_dir = tempfile.mkdtemp(prefix=f"replay{worker_id}-")
+    for path in glob.glob(os.path.join(data_dir, "*.json")):
+        shutil.copy(path, work_dir)
+    if secret:
+        pseudonymize_data(work_dir, secret)
+
+    # Count every file opened for reading or writing (JSON snapshots, change-stream appends,
+    # reminder outbox and state) so storage configurations can be compared
+    io_stats = {"reads" : 0, "bytes_read" : 0, "writes" : 0, "bytes_written" : 0}
+    real_open = builtins.open
+
+    def counting_open(file, mode="r", *args, **kwargs):
+        f = real_open(file, mode, *args, **kwargs)
+        io_stats["writes" if any(flag in mode for flag in "wax+") else "reads"] += 1
+        return CountingFile(f, io_stats)
+
+    builtins.open = counting_open
+
+    latencies = []
+    errors = 0
+    diverged = 0
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            library = LibraryManagement(work_dir)
+            # Loading the data at startup is the same for every trace, so only the operations are counted
+            io_stats.update(dict.fromkeys(io_stats, 0))
+            start = time.perf_counter()
+
+            for record in trace:
+                if record["choice"] == 13:
+                    continue
+                if speed:
+                    delay = start + record["offset"] / speed - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+
+                answers = iter(record["inputs"])
+
+                def scripted_input(prompt=""):
+                    try:
+                        return next(answers)
+                    except StopIteration:
+                        raise EOFError("trace ran out of inputs")
+
+                builtins.input = scripted_input
+                op_start = time.perf_counter()
+                try:
+                    library.due_scheduler.tick()
+                    library.perform(record["choice"])
+                except Exception:
+                    # Replayed state can diverge from the recording (e.g. a book already returned)
+                    errors += 1
+                else:
+                    # Unused answers mean the operation took another path than recorded,
+                    # e.g. a partial name lookup that was ambiguous when recorded
+                    if next(answers, None) is not None:
+                        diverged += 1
+                latencies.append((record["op"], (time.perf_counter() - op_start) * 1000))
+
+            elapsed = time.perf_counter() - start
+    finally:
+        builtins.open = real_open
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {"latencies" : latencies, "errors" : errors, "diverged" : diverged, "elapsed" : elapsed, **io_stats}
+
+
+"""Replay a trace with several concurrent workers and summarize the results"""
+def replay(trace_file, data_dir=".", workers=1, speed=1.0, label="default", key_file=None):
+    trace = load_trace(trace_file)
+    # Without the recording's key, reader lookups in the trace will not match the data copy
+    secret = load_secret(key_file or trace_file + ".key")
+    wall_start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(replay_worker, range(workers), [trace] * workers, [data_dir] * workers,
+                                [speed] * workers, [secret] * workers))
+    wall = time.perf_counter() - wall_start
+
+    latencies = [ms for result in results for _, ms in result["latencies"]]
+    per_op = {}
+    for result in results:
+        for op, ms in result["latencies"]:
+            per_op.setdefault(op, []).append(ms)
+
+    return {
+        "label" : label,
+        "trace" : trace_file,
+        "workers" : workers,
+        "speed" : speed,
+        "operations" : len(latencies),
+        "errors" : sum(result["errors"] for result in results),
+        "diverged" : sum(result["diverged"] for result in results),
+        "wall_seconds" : round(wall, 3),
+        "throughput_ops" : round(len(latencies) / wall, 2) if wall else 0,
+        "p50_ms" : round(percentile(latencies, 50), 3),
+        "p90_ms" : round(percentile(latencies, 90), 3),
+        "p99_ms" : round(percentile(latencies, 99), 3),
+        "max_ms" : round(max(latencies, default=0), 3),
+        "file_reads" : sum(result["reads"] for result in results),
+        "bytes_read" : sum(result["bytes_read"] for result in results),
+        "file_writes" : sum(result["writes"] for result in results),
+        "bytes_written" : sum(result["bytes_written"] for result in results),
+        "per_operation_p50_ms" : {op: round(percentile(values, 50), 3) for op, values in sorted(per_op.items())}
+    }
+
+
+"""Print one or more replay reports side by side"""
+def print_reports(reports):
+    metrics = ["workers", "speed", "operations", "errors", "diverged", "wall_seconds", "throughput_ops",
+               "p50_ms", "p90_ms", "p99_ms", "max_ms", "file_reads", "bytes_read", "file_writes", "bytes_written"]
+    print(f"{'metric':<16}" + "".join(f"{report['label']:>18}" for report in reports))
+    print("-" * (16 + 18 * len(reports)))
+    for metric in metrics:
+        # Reports saved by older versions lack the newer metrics
+        print(f"{metric:<16}" + "".join(f"{report.get(metric, '-'):>18}" for report in reports))
+
+
+"""Command line entry point"""
+def main(args):
+    usage = ("Usage: python workload_replay.py replay <trace.jsonl> [--data-dir DIR] [--workers N] [--speed X]\n"
+             "                                  [--label NAME] [--report out.json] [--key trace.jsonl.key]\n"
+             "       python workload_replay.py compare <report1.json> <report2.json> ...\n"
+             "Record a trace with: python Library_Management.py --record <trace.jsonl>")
+    if len(args) < 2 or args[0] not in ["replay", "compare"]:
+        print(usage)
+        return 1
+
+    if args[0] == "compare":
+        reports = []
+        for path in args[1:]:
+            with open(path, "r") as f:
+                reports.append(json.load(f))
+        print_reports(reports)
+        return 0
+
+    options = {"--data-dir" : ".", "--workers" : "1", "--speed" : "1", "--label" : "default", "--report" : None,
+               "--key" : None}
+    rest = args[2:]
+    for flag, value in zip(rest[::2], rest[1::2]):
+        if flag not in options:
+            print(usage)
+            return 1
+        options[flag] = value
+
+    report = replay(args[1], options["--data-dir"], int(options["--workers"]), float(options["--speed"]),
+                    options["--label"], options["--key"])
+    print_reports([report])
+    if options["--report"]:
+        with open(options["--report"], "w") as f:
+            json.dump(report, f, indent=4)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))